@@ -0,0 +1,99 @@
+"""
+Compare the throughput of the body serving of SwanAuthenticatedFileHandler (LargeFileMixin)
+with the plain tornado StaticFileHandler that it replaced.
+
+    python benchmarks/files_handler.py [--size MiB] [--repeat N] [--dir PATH]
+
+Use --dir to put the test file on EOS FUSE, where the difference matters most.
+"""
+import argparse
+import asyncio
+import http.client
+import os
+import tempfile
+import time
+
+from tornado import web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+from swancontents.filemanager.eos.handlers import LargeFileMixin
+
+
+class LargeFileHandler(LargeFileMixin, web.StaticFileHandler):
+    def initialize(self, path, use_sendfile):
+        super().initialize(path)
+        self.use_sendfile = use_sendfile
+
+
+def download(port, url, headers):
+    """Fetch url, discarding the body, and return the number of bytes received"""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("GET", url, headers=headers)
+    response = connection.getresponse()
+    buffer = bytearray(1024 * 1024)
+    received = 0
+    while True:
+        n = response.readinto(buffer)
+        if not n:
+            break
+        received += n
+    connection.close()
+    return received
+
+
+async def run(args):
+    root = tempfile.mkdtemp(dir=args.dir)
+    path = os.path.join(root, "data.bin")
+    with open(path, "wb") as f:
+        for _ in range(args.size):
+            f.write(os.urandom(1024 * 1024))
+
+    app = web.Application(
+        [
+            (r"/static/(.*)", web.StaticFileHandler, {"path": root}),
+            (r"/blocks/(.*)", LargeFileHandler, {"path": root, "use_sendfile": False}),
+            (r"/sendfile/(.*)", LargeFileHandler, {"path": root, "use_sendfile": True}),
+        ]
+    )
+    sockets = bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+
+    loop = asyncio.get_running_loop()
+    requests = [
+        ("full file", {}),
+        ("last half", {"Range": "bytes=%d-" % (args.size * 1024 * 1024 // 2)}),
+    ]
+    try:
+        for name, headers in requests:
+            for mode in ("static", "blocks", "sendfile"):
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    received = await loop.run_in_executor(
+                        None, download, port, "/%s/data.bin" % mode, headers
+                    )
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                print(
+                    "%-10s %-9s %8.1f MiB/s"
+                    % (name, mode, received / 1024 / 1024 / best)
+                )
+    finally:
+        server.stop()
+        os.remove(path)
+        os.rmdir(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=512, help="size of the file in MiB")
+    parser.add_argument("--repeat", type=int, default=3, help="downloads per mode, the best is kept")
+    parser.add_argument("--dir", default=None, help="folder where to create the file")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -38,6 +38,7 @@ setup_args = dict(
     install_requires=[
         "jupyter_server",
         "nbclassic",
+        "prometheus_client",
     ],
     zip_safe=False,
     include_package_data=True,
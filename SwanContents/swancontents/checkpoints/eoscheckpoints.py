@@ -1,9 +1,11 @@
 from jupyter_server.services.contents.checkpoints import AsyncCheckpoints
 from ..filemanager.eos.fileio import SwanFileManagerMixin
+from ..utils import LRUStore
+from .nbdiff import diff_notebooks
 import os
 import datetime
 from anyio.to_thread import run_sync
-from traitlets import Unicode, Int
+from traitlets import Unicode, Int, Bool, Instance, default
 from tornado.web import HTTPError
 
 
@@ -21,6 +23,12 @@ class EOSCheckpoints(SwanFileManagerMixin, AsyncCheckpoints):
         help="Number of version files to keep",
     )
 
+    list_max_versions = Bool(
+        default_value=False,
+        config=True,
+        help="Only list the newest max_versions versions of a file, instead of all the ones kept by EOS",
+    )
+
     root_dir = Unicode(config=True)
 
     # The root dir might be different than the path where jupyter has been launched from
@@ -35,7 +43,37 @@ class EOSCheckpoints(SwanFileManagerMixin, AsyncCheckpoints):
         config=True
     )
 
-    latest_recorded = {}
+    recorded_paths_size = Int(
+        default_value=1000,
+        config=True,
+        help="Number of files for which the latest version listed is remembered",
+    )
+
+    # Latest version listed for each file, to compare when creating a new one
+    latest_recorded = Instance(LRUStore)
+
+    @default('latest_recorded')
+    def _latest_recorded_default(self):
+        return LRUStore('latest_recorded', self.recorded_paths_size)
+
+    diffs_cache_size = Int(
+        default_value=100,
+        config=True,
+        help="Number of diffs between a notebook and one of its versions kept in memory",
+    )
+
+    _diffs_cache = Instance(LRUStore)
+
+    @default('_diffs_cache')
+    def _diffs_cache_default(self):
+        return LRUStore('checkpoint_diffs', self.diffs_cache_size)
+
+    # Versions found in each version folder, with the folder mtime when they were listed
+    _versions_cache = Instance(LRUStore)
+
+    @default('_versions_cache')
+    def _versions_cache_default(self):
+        return LRUStore('checkpoint_versions', self.recorded_paths_size)
 
 
     async def create_checkpoint(self, contents_mgr, path):
@@ -45,7 +83,7 @@ class EOSCheckpoints(SwanFileManagerMixin, AsyncCheckpoints):
         """
         self.log.info(f"Creating checkpoint for {path}")
         # To check if the version returned is new or already known (an error might have occurred)
-        previous_recorded = self.latest_recorded[path] if path in self.latest_recorded else None
+        previous_recorded = self.latest_recorded.get(path)
         checkpoints = await self.list_checkpoints(path)
 
         if not checkpoints:
@@ -74,13 +112,54 @@ class EOSCheckpoints(SwanFileManagerMixin, AsyncCheckpoints):
 
 
 
-    def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+    async def rename_checkpoint(self, checkpoint_id, old_path, new_path):
         """
             Called when notebook file is renamed.
             EOS should handle this by itself.
         """
         pass
 
+    async def rename_all_checkpoints(self, old_path, new_path):
+        """ Forget what is known about the old path once the file was renamed """
+        await super().rename_all_checkpoints(old_path, new_path)
+        self._forget_path(old_path)
+
+    async def delete_all_checkpoints(self, path):
+        """ Forget what is known about the path once the file was deleted """
+        await super().delete_all_checkpoints(path)
+        self._forget_path(path)
+
+    async def diff_checkpoint(self, checkpoint_id, path):
+        """
+            Compare the current notebook with one of its versions, cell by cell,
+            so that it can be previewed before restoring it.
+        """
+        checkpoint = self._get_checkpoint_info(path, checkpoint_id)
+
+        try:
+            current = await run_sync(os.stat, checkpoint['src_path'])
+        except FileNotFoundError:
+            raise HTTPError(404, u'No such file: %s' % path)
+
+        # Versions never change, but the current file does
+        key = (path, checkpoint['id'], current.st_mtime_ns, current.st_size)
+        diff = self._diffs_cache.get(key)
+        if diff is None:
+            try:
+                with self.perm_to_403():
+                    diff = await run_sync(diff_notebooks, checkpoint['checkpoint_path'], checkpoint['src_path'])
+            except (FileNotFoundError, NotADirectoryError):
+                self._no_such_checkpoint(path, checkpoint_id)
+            except ValueError as e:
+                raise HTTPError(400, u'Cannot compare %s with its version %s: %s' % (path, checkpoint_id, e))
+            self._diffs_cache[key] = diff
+
+        return dict(
+            path=path,
+            checkpoint_id=checkpoint_id,
+            cells=diff,
+        )
+
     async def delete_checkpoint(self, checkpoint_id, path):
         """Remove a created version"""
         cp_path = self._get_checkpoint_info(path, checkpoint_id)['checkpoint_path']
@@ -97,18 +176,47 @@ class EOSCheckpoints(SwanFileManagerMixin, AsyncCheckpoints):
         base = self._get_checkpoint_base(path)
 
         try:
-            files = await run_sync(os.listdir, base['base_path'])
-            files.sort()
-            to_return = [self._get_checkpoint_return(file) for file in files]
+            versions = await run_sync(self._list_versions, base['base_path'])
+            to_return = [checkpoint for _, checkpoint in versions]
             # Keep track of the latest version to compare when creating a new one
             self.latest_recorded[path] = to_return[-1]
-            return to_return
         except: # If folder doesn't exist or we get permission denied/not accessible (the case in old FUSE)
             return []
 
+        if self.list_max_versions:
+            return to_return[-self.max_versions:]
+        return to_return
+
 
     # Aux functions
 
+    # Get the sorted (file name, checkpoint) of the versions inside a version folder.
+    # The folder is only listed again if its mtime changed and only the new files are parsed.
+    def _list_versions(self, base_path):
+        mtime = os.stat(base_path).st_mtime_ns
+        cached = self._versions_cache.get(base_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        files = set(os.listdir(base_path))
+        versions = [version for version in cached[1] if version[0] in files] if cached else []
+        new_files = sorted(files.difference(name for name, _ in versions))
+        new_versions = [(file, self._get_checkpoint_return(file)) for file in new_files]
+
+        if versions and new_versions and new_versions[0][0] < versions[-1][0]:
+            versions = sorted(versions + new_versions, key=lambda version: version[0])
+        else:
+            # New versions are newer than the known ones, which is the usual case after a save
+            versions = versions + new_versions
+
+        self._versions_cache[base_path] = (mtime, versions)
+        return versions
+
+    # Drop the entries of a path from the in-memory stores
+    def _forget_path(self, path):
+        self.latest_recorded.pop(path)
+        self._versions_cache.pop(self._get_checkpoint_base(path)['base_path'])
+
     # Get the info of a version which id is given
     def _get_checkpoint_info(self, path, id):
         id = id.replace('_', '.') # Jupyter does not support . in the url
@@ -0,0 +1,87 @@
+"""
+Cell-level comparison of two notebooks, used to preview a version before restoring it.
+"""
+
+from difflib import SequenceMatcher, unified_diff
+import hashlib
+import json
+
+
+def _read_cells(os_path):
+    """ Read the cells of a notebook, keeping only what is needed to compare them.
+        Outputs (which hold the embedded images) are reduced to a digest straight away.
+    """
+    with open(os_path, 'r', encoding='utf-8') as f:
+        nb = json.load(f)
+
+    cells = []
+    for cell in nb.get('cells', []):
+        source = cell.get('source', '')
+        if isinstance(source, list):
+            source = ''.join(source)
+        outputs = json.dumps(cell.get('outputs', []), sort_keys=True).encode('utf-8')
+        cells.append(dict(
+            cell_type=cell.get('cell_type'),
+            source=source,
+            outputs=hashlib.sha1(outputs).hexdigest(),
+        ))
+    return cells
+
+
+def _cell_entry(op, cell, checkpoint_index=None, current_index=None):
+    return dict(
+        op=op,
+        cell_type=cell['cell_type'],
+        checkpoint_index=checkpoint_index,
+        current_index=current_index,
+    )
+
+
+def diff_notebooks(checkpoint_path, current_path):
+    """ Return the list of changes needed to go from the notebook in checkpoint_path to the one in current_path.
+        Each entry has an op ('unchanged', 'added', 'removed' or 'modified'), the cell type and the index
+        of the cell in each notebook. Modified cells also contain the unified diff of their source and
+        whether their outputs changed.
+    """
+    old_cells = _read_cells(checkpoint_path)
+    new_cells = _read_cells(current_path)
+
+    # Cells are matched on their type and source, outputs are compared afterwards
+    old_keys = [(cell['cell_type'], cell['source']) for cell in old_cells]
+    new_keys = [(cell['cell_type'], cell['source']) for cell in new_cells]
+
+    changes = []
+    matcher = SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                op = 'unchanged' if old_cells[i]['outputs'] == new_cells[j]['outputs'] else 'modified'
+                entry = _cell_entry(op, new_cells[j], i, j)
+                if op == 'modified':
+                    entry.update(source_diff=[], outputs_changed=True)
+                changes.append(entry)
+            continue
+
+        # Cells replaced in place are reported as modified, the remaining ones as removed or added
+        paired = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+        for i, j in zip(range(i1, i1 + paired), range(j1, j1 + paired)):
+            entry = _cell_entry('modified', new_cells[j], i, j)
+            entry.update(
+                source_diff=list(unified_diff(
+                    old_cells[i]['source'].splitlines(),
+                    new_cells[j]['source'].splitlines(),
+                    lineterm='',
+                )),
+                outputs_changed=old_cells[i]['outputs'] != new_cells[j]['outputs'],
+            )
+            changes.append(entry)
+        for i in range(i1 + paired, i2):
+            entry = _cell_entry('removed', old_cells[i], checkpoint_index=i)
+            entry['source'] = old_cells[i]['source']
+            changes.append(entry)
+        for j in range(j1 + paired, j2):
+            entry = _cell_entry('added', new_cells[j], current_index=j)
+            entry['source'] = new_cells[j]['source']
+            changes.append(entry)
+
+    return changes
@@ -0,0 +1,295 @@
+"""Node-local cache of the projects downloaded into SWAN_projects"""
+
+from ..metrics import CACHE_ENTRIES, CACHE_LOOKUPS
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+def _copy_tree(src, dest=None, readable=False):
+    """ Copy a folder into dest, keeping symlinks, and return the sha256 of its content (names,
+        files and link targets) and the size of its files. Without dest, only computes them.
+        If readable, the copy can be read by everyone.
+    """
+
+    digest = hashlib.sha256()
+    size = 0
+
+    def copy(src_dir, dest_dir, rel_path):
+        nonlocal size
+        if dest_dir is not None:
+            os.makedirs(dest_dir, exist_ok=True)
+        with os.scandir(src_dir) as it:
+            entries = sorted(it, key=lambda e: e.name)
+
+        for entry in entries:
+            name = os.fsencode(os.path.join(rel_path, entry.name))
+            target = os.path.join(dest_dir, entry.name) if dest_dir is not None else None
+            if entry.is_symlink():
+                link = os.readlink(entry.path)
+                digest.update(b'L\0%s\0%s\0' % (name, os.fsencode(link)))
+                if target:
+                    os.symlink(link, target)
+            elif entry.is_dir():
+                digest.update(b'D\0%s\0' % name)
+                copy(entry.path, target, os.path.join(rel_path, entry.name))
+            else:
+                file_size = entry.stat().st_size
+                digest.update(b'F\0%s\0%d\0' % (name, file_size))
+                size += file_size
+                with open(entry.path, 'rb') as fsrc:
+                    fdst = open(target, 'wb') if target else None
+                    try:
+                        for data in iter(lambda: fsrc.read(1024 * 1024), b''):
+                            digest.update(data)
+                            if fdst:
+                                fdst.write(data)
+                    finally:
+                        if fdst:
+                            fdst.close()
+                if target:
+                    shutil.copystat(entry.path, target)
+                    if readable:
+                        os.chmod(target, os.stat(target).st_mode | 0o444)
+
+        if dest_dir is not None:
+            shutil.copystat(src_dir, dest_dir)
+            if readable:
+                os.chmod(dest_dir, os.stat(dest_dir).st_mode | 0o555)
+
+    copy(src, dest, '')
+    return digest.hexdigest(), size
+
+
+class DownloadCache:
+    """
+    Content-addressed cache of downloaded files and cloned repositories.
+    Downloads are stored once per content (sha256 of files, commit of repositories) under
+    objects/, and looked up through entries keyed by what identifies a version of a URL
+    (e.g. its ETag or the commit of the repository). The least recently used entries are
+    evicted when the objects take more than max_bytes.
+
+    A shared cache is used by the servers of all the users of the node: everyone can read
+    the downloads and add new ones, but only replace or evict their own (the folders are
+    sticky, like /tmp). Otherwise, the cache is only accessible to its owner.
+    """
+
+    def __init__(self, path, max_bytes, log=None, shared=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.log = log
+        self.shared = shared
+        self.objects_path = os.path.join(path, 'objects')
+        self.entries_path = os.path.join(path, 'entries')
+        self.file_mode = 0o644 if shared else 0o600
+        for folder, mode in ((path, 0o755), (self.objects_path, 0o1777), (self.entries_path, 0o1777)):
+            os.makedirs(folder, exist_ok=True)
+            try:
+                os.chmod(folder, mode if shared else 0o700)
+            except PermissionError:
+                # Created by the server of another user
+                pass
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def _lookup(self, key, kind):
+        """ Return the entry and the path of its object, marking it as recently used, or None if it is not cached """
+
+        entry_path = os.path.join(self.entries_path, key)
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+            object_path = os.path.join(self.objects_path, entry['object'])
+            if entry['kind'] != kind or not os.path.exists(object_path):
+                raise FileNotFoundError(object_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(entry_path)
+        except PermissionError:
+            # Entry of another user of a shared cache, it's used anyway
+            pass
+        return entry, object_path
+
+    def _discard(self, key, entry):
+        """ Remove an entry whose object is corrupted, and the object """
+
+        if self.log:
+            self.log.warning("Discarding corrupted %s from the download cache", entry['object'])
+        object_path = os.path.join(self.objects_path, entry['object'])
+        try:
+            if os.path.isdir(object_path):
+                shutil.rmtree(object_path, ignore_errors=True)
+            elif os.path.exists(object_path):
+                os.remove(object_path)
+            os.remove(os.path.join(self.entries_path, key))
+        except OSError:
+            # Stored by another user of a shared cache
+            pass
+
+    @staticmethod
+    def _count(hit):
+        CACHE_LOOKUPS.labels(cache='downloads', result='hit' if hit else 'miss').inc()
+
+    def open_file(self, key):
+        """ Open the cached file of an entry, or return None if it is not cached or its content changed """
+
+        found = self._lookup(key, 'file')
+        f = None
+        if found:
+            entry, object_path = found
+            try:
+                f = open(object_path, 'rb')
+                # Files are stored under the sha256 of their content
+                digest = hashlib.sha256()
+                for data in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(data)
+                if digest.hexdigest() != entry['object']:
+                    f.close()
+                    f = None
+                    self._discard(key, entry)
+                else:
+                    f.seek(0)
+            except OSError:
+                if f:
+                    f.close()
+                f = None
+
+        self._count(f is not None)
+        return f
+
+    def restore_tree(self, key, dest):
+        """ Copy the cached repository of an entry into dest, checking that its content did not change.
+            The files are copied, not hardlinked, so that editing them does not change the cache.
+            Returns False, leaving dest empty, if it is not cached.
+        """
+
+        found = self._lookup(key, 'tree')
+        restored = False
+        if found and 'digest' in found[0]:
+            entry, object_path = found
+            try:
+                restored = _copy_tree(object_path, dest)[0] == entry['digest']
+                if not restored:
+                    self._discard(key, entry)
+            except OSError as e:
+                if self.log:
+                    self.log.warning("Could not restore %s from the download cache: %s", entry['object'], e)
+            if not restored:
+                shutil.rmtree(dest, ignore_errors=True)
+                os.makedirs(dest, exist_ok=True)
+
+        self._count(restored)
+        return restored
+
+    def store_file(self, key, data_file):
+        """ Store the content of a file object (read from its current position) for an entry """
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_path, prefix='.tmp')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    data = data_file.read(1024 * 1024)
+                    if not data:
+                        break
+                    digest.update(data)
+                    size += len(data)
+                    f.write(data)
+            os.chmod(tmp_path, self.file_mode)
+            object_path = os.path.join(self.objects_path, digest.hexdigest())
+            try:
+                os.replace(tmp_path, object_path)
+            except PermissionError:
+                # Another user of a shared cache stored the same content first
+                if not os.path.isfile(object_path):
+                    raise
+                os.remove(tmp_path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._add_entry(key, 'file', digest.hexdigest(), size)
+
+    def store_tree(self, key, object_name, src):
+        """ Store a copy of a cloned repository for an entry, under a name identifying its content
+            (e.g. its commit and how it was cloned), with the digest of the files to check it when restored
+        """
+
+        object_path = os.path.join(self.objects_path, object_name)
+        if os.path.isdir(object_path):
+            digest, size = _copy_tree(object_path)
+        else:
+            tmp_path = tempfile.mkdtemp(dir=self.objects_path, prefix='.tmp')
+            try:
+                digest, size = _copy_tree(src, tmp_path, readable=self.shared)
+                os.replace(tmp_path, object_path)
+            except OSError:
+                # Another server stored it in the meantime, or the copy failed
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                if not os.path.isdir(object_path):
+                    raise
+                digest, size = _copy_tree(object_path)
+
+        self._add_entry(key, 'tree', object_name, size, digest=digest)
+
+    def _add_entry(self, key, kind, object_name, size, **extra):
+        entry_path = os.path.join(self.entries_path, key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.entries_path, prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(kind=kind, object=object_name, size=size, stored=time.time(), **extra), f)
+        os.chmod(tmp_path, self.file_mode)
+        try:
+            os.replace(tmp_path, entry_path)
+        except PermissionError:
+            # Another user of a shared cache stored it first
+            os.remove(tmp_path)
+        self._evict()
+
+    def _evict(self):
+        """ Remove the least recently used entries, and the objects no longer used, until the cache fits in max_bytes """
+
+        entries = []
+        for name in os.listdir(self.entries_path):
+            if name.startswith('.tmp'):
+                continue
+            entry_path = os.path.join(self.entries_path, name)
+            try:
+                with open(entry_path) as f:
+                    entry = json.load(f)
+                entries.append((os.stat(entry_path).st_mtime, entry_path, entry))
+            except (OSError, ValueError):
+                continue
+
+        entries.sort(key=lambda e: e[0])
+        sizes = {entry['object']: entry['size'] for _, _, entry in entries}
+        total = sum(sizes.values())
+
+        while entries and total > self.max_bytes:
+            _, entry_path, entry = entries.pop(0)
+            try:
+                os.remove(entry_path)
+            except OSError:
+                # Entry of another user of a shared cache
+                continue
+            if all(other['object'] != entry['object'] for _, _, other in entries):
+                total -= sizes[entry['object']]
+                object_path = os.path.join(self.objects_path, entry['object'])
+                if os.path.isdir(object_path):
+                    shutil.rmtree(object_path, ignore_errors=True)
+                elif os.path.exists(object_path):
+                    try:
+                        os.remove(object_path)
+                    except OSError:
+                        pass
+                if self.log:
+                    self.log.debug("Evicted %s from the download cache", entry['object'])
+
+        CACHE_ENTRIES.labels(cache='downloads').set(len(entries))
@@ -0,0 +1,105 @@
+"""Track the progress of the projects being downloaded into SWAN_projects"""
+
+import asyncio
+import re
+import time
+import uuid
+
+# git reports its progress on stderr, e.g. "Receiving objects:  45% (450/1000), 1.20 MiB | 2.00 MiB/s"
+GitProgressRE = re.compile(r'Receiving objects:\s+\d+% \((\d+)/(\d+)\)(?:, ([\d.]+) (bytes|KiB|MiB|GiB))?')
+
+git_size_units = {
+    'bytes': 1,
+    'KiB': 1024,
+    'MiB': 1024 ** 2,
+    'GiB': 1024 ** 3,
+}
+
+
+def parse_git_progress(line):
+    """ Return the progress reported by a line of git clone --progress, or None if it is not a progress line """
+
+    match = GitProgressRE.search(line)
+    if not match:
+        return None
+
+    progress = dict(objects_received=int(match.group(1)), objects_total=int(match.group(2)))
+    if match.group(3):
+        progress['bytes_received'] = int(float(match.group(3)) * git_size_units[match.group(4)])
+    return progress
+
+
+class DownloadJob:
+    """
+    A download of a project running in the background.
+    Listeners are woken up every time its progress or status changes.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    ERROR = 'error'
+
+    def __init__(self, url):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.status = self.PENDING
+        self.model = None
+        self.error = None
+        self.bytes_received = 0
+        self.objects_received = 0
+        self.objects_total = None
+        self.started = time.time()
+        # Incremented on every change, so that listeners know if they missed one
+        self.version = 0
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.ERROR)
+
+    def update(self, **progress):
+        """ Update the job. Can be called from worker threads. """
+
+        def apply():
+            for key, value in progress.items():
+                setattr(self, key, value)
+            self.version += 1
+            # Wake up the current listeners, the next ones wait on a new event
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            apply()
+        else:
+            self._loop.call_soon_threadsafe(apply)
+
+    async def wait_for_change(self, version, timeout=None):
+        """ Wait until the job changes after the version given, returning False if the timeout expired first """
+
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            url=self.url,
+            status=self.status,
+            model=self.model,
+            error=self.error,
+            bytes_received=self.bytes_received,
+            objects_received=self.objects_received,
+            objects_total=self.objects_total,
+            started=self.started,
+        )
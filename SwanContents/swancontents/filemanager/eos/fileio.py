@@ -1,13 +1,40 @@
 from jupyter_core.paths import is_hidden
 from jupyter_server.services.contents import filemanager
 from jupyter_server.services.contents.fileio import AsyncFileManagerMixin
-from jupyter_server.utils import url_path_join
+from anyio.to_thread import run_sync
+from base64 import decodebytes
+from datetime import datetime, timezone
+from tornado.ioloop import PeriodicCallback
 from tornado.web import HTTPError
+from traitlets import Any, Bool, Dict, Enum, Float, Instance, Int, default
+from ...metrics import SAVE_DURATION_SECONDS
+from .sharing import swan_sharing_folder, get_shared_path_resolver
 from contextlib import contextmanager
+import errno
 import io, os
 import subprocess
+import threading
+import time
 
-swan_sharing_folder = 'swan_sharing_folder/'
+# Extended attribute that makes EOS create a version of a file when it is replaced by a rename
+eos_rename_version_attr = 'user.fusex.rename.version'
+
+
+class _RenameVersionState:
+    """Writes of a directory relying on the versioning attribute"""
+
+    def __init__(self):
+        # Number of writes, guarded by _rename_version_lock
+        self.users = 0
+        # Whether the attribute is set, guarded by lock, which is held during the syscalls
+        # so that a slow answer from EOS only holds back the writes of the same directory
+        self.enabled = False
+        self.lock = threading.Lock()
+
+
+# State of the directories with writes relying on the versioning attribute
+_rename_version_users = {}
+_rename_version_lock = threading.Lock()
 
 
 def _is_hidden(path, root):
@@ -31,8 +58,141 @@ def _is_hidden(path, root):
 filemanager.is_hidden = _is_hidden
 
 
+def _set_rename_version(dirname, enable, log=None):
+    """
+    Set (or remove) the EOS versioning attribute of a directory.
+    Uses the xattr syscalls when the platform provides them and the setfattr
+    command otherwise. Failures are not fatal: the file is still saved, only
+    without creating a version (e.g. filesystems without xattr support).
+    """
+    if not hasattr(os, 'setxattr'):
+        if enable:
+            subprocess.run(["setfattr", "-n", eos_rename_version_attr, "-v", "1", dirname])
+        else:
+            subprocess.run(["setfattr", "-x", eos_rename_version_attr, dirname])
+        return
+
+    try:
+        if enable:
+            os.setxattr(dirname, eos_rename_version_attr, b'1')
+        else:
+            os.removexattr(dirname, eos_rename_version_attr)
+    except OSError as e:
+        if log and e.errno not in (errno.ENOTSUP, errno.ENODATA):
+            log.warning("Could not %s %s on %s: %s",
+                        'set' if enable else 'remove', eos_rename_version_attr, dirname, e)
+
+
+@contextmanager
+def eos_rename_version(dirname, log=None):
+    """
+    Context manager that enables the creation of EOS versions on rename in a directory.
+    Concurrent writes in the same directory share the attribute: it is set by the first
+    one to enter and removed by the last one to leave.
+    """
+    with _rename_version_lock:
+        state = _rename_version_users.setdefault(dirname, _RenameVersionState())
+        state.users += 1
+
+    try:
+        with state.lock:
+            if not state.enabled:
+                _set_rename_version(dirname, True, log)
+                state.enabled = True
+        yield
+    finally:
+        with _rename_version_lock:
+            state.users -= 1
+
+        # Revert to the default behaviour once nobody needs it anymore
+        with state.lock:
+            with _rename_version_lock:
+                idle = state.users == 0
+            if idle and state.enabled:
+                _set_rename_version(dirname, False, log)
+                state.enabled = False
+            with _rename_version_lock:
+                if state.users == 0 and _rename_version_users.get(dirname) is state:
+                    del _rename_version_users[dirname]
+
+
+def _get_tmp_path(path):
+    """Return the real target of a write and the temporary file used to write it atomically"""
+    # realpath doesn't work on Windows: http://bugs.python.org/issue9949
+    # Luckily, we only need to resolve the file itself being a symlink, not
+    # any of its directories, so this will suffice:
+    if os.path.islink(path):
+        path = os.path.join(os.path.dirname(path), os.readlink(path))
+
+    dirname, basename = os.path.split(path)
+    # The .~ prefix will make Dropbox ignore the temporary file.
+    return path, os.path.join(dirname, '.~'+basename)
+
+
+class DeferredSync:
+    """
+    Syncs files to disk from a background thread, at a fixed interval.
+    Files saved several times between two flushes are only synced once.
+    """
+
+    def __init__(self, interval, log=None):
+        self.interval = interval
+        self.log = log
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='swan-deferred-sync', daemon=True)
+        self._thread.start()
+
+    def add(self, path):
+        with self._lock:
+            self._pending.add(path)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+
+        for path in pending:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                # The file might have been removed or renamed in the meantime
+                if self.log:
+                    self.log.debug("Could not sync %s: %s", path, e)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+def sync_to_disk(fileobj, durability):
+    """Flush a file object and make its content durable according to the durability level"""
+    fileobj.flush()
+    if durability == 'fsync':
+        os.fsync(fileobj.fileno())
+    elif durability == 'fdatasync':
+        # Skips the metadata that is not needed to read the file back (e.g. mtime)
+        getattr(os, 'fdatasync', os.fsync)(fileobj.fileno())
+    # 'deferred' is synced by DeferredSync after the rename and 'none' is left to the OS
+
+
+def replace_with_version(tmp_path, path, log=None):
+    """Rename the temporary file to the target, creating an EOS version of the latter"""
+    # This is an atomic operation and will silently replace the current file
+    if path.startswith('/eos/'):
+        # To create a version of the file, enable that eos functionality on the parent directory
+        with eos_rename_version(os.path.dirname(path), log):
+            os.replace(tmp_path, path)
+    else:
+        os.replace(tmp_path, path)
+
+
 @contextmanager
-def atomic_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
+def atomic_writing(path, text=True, encoding='utf-8', log=None, durability='fsync', deferred_sync=None, **kwargs):
     """Context manager to write to a file only if the entire write is successful.
 
     This works by writing the contents to a temp file and rename it to the target.
@@ -50,18 +210,17 @@ def atomic_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
     encoding : str, optional
       The encoding to use for files opened in text mode. Default is UTF-8.
 
+    durability : str, optional
+      How the content is synced to disk before the rename: 'fsync' (default),
+      'fdatasync', 'deferred' (synced later by `deferred_sync`) or 'none'.
+
+    deferred_sync : DeferredSync, optional
+      Background flusher used with the 'deferred' durability.
+
     **kwargs
       Passed to :func:`io.open`.
     """
-    # realpath doesn't work on Windows: http://bugs.python.org/issue9949
-    # Luckily, we only need to resolve the file itself being a symlink, not
-    # any of its directories, so this will suffice:
-    if os.path.islink(path):
-        path = os.path.join(os.path.dirname(path), os.readlink(path))
-
-    dirname, basename = os.path.split(path)
-    # The .~ prefix will make Dropbox ignore the temporary file.
-    tmp_path = os.path.join(dirname, '.~'+basename)
+    path, tmp_path = _get_tmp_path(path)
 
     if text:
         # Make sure that text files have Unix linefeeds by default
@@ -74,18 +233,13 @@ def atomic_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
         yield fileobj
 
         # Flush to disk
-        fileobj.flush()
-        os.fsync(fileobj.fileno())
+        sync_to_disk(fileobj, durability)
         fileobj.close()
 
-        # To create a version of the file, enable that eos functionality on the parent directory
-        if path.startswith('/eos/'):
-            subprocess.run(["setfattr","-n", "user.fusex.rename.version", "-v", "1", dirname])
+        replace_with_version(tmp_path, path, log)
 
-        # Try to rename tmp file to the original name
-        # This is an atomic operation and will silently replace the current file
-        # This operation will also create a version automatically, since we set the option before
-        os.replace(tmp_path, path)
+        if durability == 'deferred' and deferred_sync:
+            deferred_sync.add(path)
 
     except:
         # Close the file in case it failed writing
@@ -97,12 +251,39 @@ def atomic_writing(path, text=True, encoding='utf-8', log=None, **kwargs):
         # Even if renaming failed, there's nothing else to do because the temp was already deleted....
         raise
 
-    finally:
-        # Remove the versioning option to revert to default behaviour
-        # This will complain if the exception occurred before setting this attr,
-        # but it will not generate a new exception.
-        if path.startswith('/eos/'):
-            subprocess.run(["setfattr","-x", "user.fusex.rename.version", dirname])
+
+class _StreamingUpload:
+    """A chunked upload in progress, written to its temporary file through a handle kept open across chunks"""
+
+    def __init__(self, path, tmp_path, buffer_size):
+        self.path = path
+        self.tmp_path = tmp_path
+        self.fileobj = io.open(tmp_path, 'wb', buffering=buffer_size)
+        self.created = datetime.now(timezone.utc)
+        self.last_used = time.monotonic()
+        self.size = 0
+
+    def write(self, content):
+        self.fileobj.write(content)
+        self.size += len(content)
+
+    def finish(self, log=None, durability='fsync', deferred_sync=None):
+        """Flush the whole file to disk once and move it into place"""
+        try:
+            sync_to_disk(self.fileobj, durability)
+            self.fileobj.close()
+            replace_with_version(self.tmp_path, self.path, log)
+        except:
+            self.abort()
+            raise
+
+        if durability == 'deferred' and deferred_sync:
+            deferred_sync.add(self.path)
+
+    def abort(self):
+        self.fileobj.close()
+        if os.path.isfile(self.tmp_path):
+            os.remove(self.tmp_path)
 
 
 class SwanFileManagerMixin(AsyncFileManagerMixin):
@@ -113,24 +294,195 @@ class SwanFileManagerMixin(AsyncFileManagerMixin):
     generic files.
     """
 
+    stream_uploads = Bool(
+        default_value=True,
+        config=True,
+        help="""Write the chunks of an upload to a single temporary file kept open between chunks,
+        which is synced and moved into place only once the last chunk arrives.
+        Otherwise, every chunk re-opens the file to append to it.""",
+    )
+
+    upload_idle_timeout = Float(
+        default_value=600,
+        config=True,
+        help="Seconds after which an upload that stopped receiving chunks is abandoned and its temporary file removed",
+    )
+
+    upload_buffer_size = Int(
+        default_value=8 * 1024 * 1024,
+        config=True,
+        help="Size of the write buffer of streamed uploads, so that EOS receives few large writes",
+    )
+
+    durability = Enum(
+        ['fsync', 'fdatasync', 'deferred', 'none'],
+        default_value='fsync',
+        config=True,
+        help="""How saved files are synced to disk before replacing the previous version:
+        'fsync' syncs data and metadata, 'fdatasync' only what is needed to read the data back,
+        'deferred' syncs them in the background every durability_flush_interval milliseconds
+        (several saves of the same file are synced once) and 'none' leaves it to the operating system.""",
+    )
+
+    durability_flush_interval = Int(
+        default_value=1000,
+        config=True,
+        help="Milliseconds between two background syncs of the files saved with the 'deferred' durability",
+    )
+
+    _deferred_sync = Instance(DeferredSync)
+
+    @default('_deferred_sync')
+    def _deferred_sync_default(self):
+        return DeferredSync(self.durability_flush_interval / 1000, log=self.log)
+
+    # Uploads in progress, by file system path
+    _uploads = Dict()
+
+    # Periodic check of the uploads in progress, running while there are some
+    _upload_sweeper = Any(None)
+
     def _get_os_path(self, path):
         """ Given an API path (i.e. SWAN_projects/Proj1), return its file system path (/eos/user/u/usera/SWAN_projects/Proj1).
             The SWAN version allows access to paths outside the root folder (/eos/user/u/usera) for the shared folders specific case
         """
 
-        if path.startswith(swan_sharing_folder):
-            path = path.split('/')
-            if len(path) < 3:
-                 raise HTTPError(404)
-                
-            eosbasepath_format = os.getenv('EOS_PATH_FORMAT', '/eos/user/{username[0]}/{username}/')
-            user_basepath = eosbasepath_format.format(username = path[1])
-            return url_path_join(user_basepath, 'SWAN_projects', *(path[2:]))
+        shared_path = get_shared_path_resolver().resolve(path)
+        if shared_path is not None:
+            return shared_path
 
         else:
             return super()._get_os_path(path)
 
 
+    async def save(self, model, path=''):
+        """ Save the chunks of large uploads through a streamed upload, if enabled """
+
+        chunk = model.get('chunk', None)
+        if chunk is None or not self.stream_uploads:
+            return await super().save(model, path)
+
+        path = path.strip('/')
+
+        if chunk == 1:
+            self.run_pre_save_hooks(model=model, path=path)
+
+        if 'type' not in model:
+            raise HTTPError(400, u'No file type provided')
+        if model['type'] != 'file':
+            raise HTTPError(400, u'File type "%s" is not supported for large file transfer' % model['type'])
+        if 'content' not in model:
+            raise HTTPError(400, u'No file content provided')
+
+        os_path = self._get_os_path(path)
+        self.log.debug("Saving chunk %s of file %s", chunk, os_path)
+
+        try:
+            upload = await self._save_chunk(os_path, model['content'], model.get('format'), chunk)
+        except HTTPError:
+            raise
+        except Exception as e:
+            self.log.error(u'Error while saving file: %s %s', path, e, exc_info=True)
+            raise HTTPError(500, f"Unexpected error while saving file: {path} {e}") from e
+
+        if chunk != -1:
+            # The file only exists in its final location after the last chunk
+            return self._upload_model(path, upload)
+
+        model = await self.get(path, content=False)
+        self.run_post_save_hooks(model=model, os_path=os_path)
+        self.emit(data={"action": "save", "path": path})
+        return model
+
+    async def _save_chunk(self, os_path, content, format, chunk):
+        """ Append one chunk to the upload of os_path, starting it on the first chunk and finishing it on the last one """
+
+        if format not in {'text', 'base64'}:
+            raise HTTPError(400, u"Must specify format of file contents as 'text' or 'base64'")
+        try:
+            if format == 'text':
+                bcontent = content.encode('utf8')
+            else:
+                bcontent = decodebytes(content.encode('ascii'))
+        except Exception as e:
+            raise HTTPError(400, f"Encoding error saving {os_path}: {e}") from e
+
+        with self.perm_to_403(os_path):
+            if chunk == 1:
+                previous = self._uploads.pop(os_path, None)
+                if previous:
+                    # The same file is being uploaded again from the start
+                    await run_sync(previous.abort)
+                path, tmp_path = _get_tmp_path(os_path)
+                self._uploads[os_path] = await run_sync(_StreamingUpload, path, tmp_path, self.upload_buffer_size)
+                self._start_upload_sweeper()
+
+            upload = self._uploads.get(os_path)
+            if upload is None:
+                raise HTTPError(400, u"No upload in progress for %s, it needs to be restarted" % os_path)
+
+            try:
+                await run_sync(upload.write, bcontent)
+            except:
+                del self._uploads[os_path]
+                await run_sync(upload.abort)
+                raise
+            upload.last_used = time.monotonic()
+
+            if chunk == -1:
+                del self._uploads[os_path]
+                await run_sync(upload.finish, self.log, self.durability, self._get_deferred_sync())
+
+        return upload
+
+    def _get_deferred_sync(self):
+        """ Background flusher, only started when the deferred durability is used """
+
+        if self.durability == 'deferred':
+            return self._deferred_sync
+        return None
+
+    def _start_upload_sweeper(self):
+        """ Check the uploads in progress periodically, while there are some, to abandon the idle ones """
+
+        if self._upload_sweeper is None:
+            self._upload_sweeper = PeriodicCallback(self._expire_uploads, self.upload_idle_timeout * 1000 / 2)
+            self._upload_sweeper.start()
+
+    async def _expire_uploads(self):
+        """ Abandon the uploads that did not receive any chunk for too long """
+
+        deadline = time.monotonic() - self.upload_idle_timeout
+        expired = [(os_path, upload) for os_path, upload in self._uploads.items() if upload.last_used < deadline]
+        # Forget them all before removing their files, off the event loop, so they are only aborted once
+        for os_path, upload in expired:
+            self.log.warning("Abandoning idle upload of %s", os_path)
+            del self._uploads[os_path]
+        for os_path, upload in expired:
+            await run_sync(upload.abort)
+
+        if not self._uploads and self._upload_sweeper is not None:
+            self._upload_sweeper.stop()
+            self._upload_sweeper = None
+
+    def _upload_model(self, path, upload):
+        """ Model returned for the chunks of an upload that is not finished yet """
+
+        return {
+            'name': path.rsplit('/', 1)[-1],
+            'path': path,
+            'type': 'file',
+            'last_modified': datetime.now(timezone.utc),
+            'created': upload.created,
+            'content': None,
+            'format': None,
+            'mimetype': None,
+            'size': upload.size,
+            'writable': True,
+            'hash': None,
+            'hash_algorithm': None,
+        }
+
     @contextmanager
     def atomic_writing(self, os_path, *args, **kwargs):
         """Overload the default atomic_writing to use a different write method
@@ -140,9 +492,12 @@ class SwanFileManagerMixin(AsyncFileManagerMixin):
         simply writes the file (whatever an old exists or not)"""
 
         if self.use_atomic_writing:
+            start = time.monotonic()
             with self.perm_to_403(os_path):
-                with atomic_writing(os_path, *args, log=self.log, **kwargs) as f:
+                with atomic_writing(os_path, *args, log=self.log, durability=self.durability,
+                                    deferred_sync=self._get_deferred_sync(), **kwargs) as f:
                     yield f
+            SAVE_DURATION_SECONDS.labels(durability=self.durability).observe(time.monotonic() - start)
         else:
             # Return to the default behaviour
             super().atomic_writing(os_path, *args, **kwargs)
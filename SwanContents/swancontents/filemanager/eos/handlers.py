@@ -1,32 +1,179 @@
 from jupyter_server.base.handlers import AuthenticatedFileHandler
 from jupyter_server.utils import url_path_join
-from tornado import web
+from anyio.to_thread import run_sync
+from tornado import iostream, web
+from .sharing import get_shared_path_resolver
+import asyncio
 import os
+import select
 
+# Seconds to wait for a client to accept more data before giving up on it
+SendfileTimeout = 60
 
-class SwanAuthenticatedFileHandler(AuthenticatedFileHandler):
+
+def _sendfile(sock, fd, offset, count, timeout=SendfileTimeout):
+    """
+    Copy count bytes of the file from offset to a non-blocking socket, in the kernel.
+    Blocks until everything is sent, so it has to run outside of the event loop.
+    Returns the number of bytes sent, which is less than count if the file got shorter.
+    """
+    poller = select.poll()
+    poller.register(sock.fileno(), select.POLLOUT)
+    total = 0
+    while total < count:
+        try:
+            sent = os.sendfile(sock.fileno(), fd, offset + total, count - total)
+        except BlockingIOError:
+            if not poller.poll(timeout * 1000):
+                raise TimeoutError("The client did not read for %d seconds" % timeout)
+            continue
+        if sent == 0:
+            break
+        total += sent
+    return total
+
+
+class LargeFileMixin:
+    """
+    Serve the body of a StaticFileHandler response without blocking the event loop on the
+    file reads, which can take long on EOS FUSE.
+    Big responses on plain HTTP connections are sent with sendfile, from a thread, and close the
+    connection afterwards; the others are read in a thread by large blocks, reading the next
+    block while the current one is sent.
+    Status, ranges and headers are still handled by StaticFileHandler, with an ETag taken
+    from the modification time and size of the file instead of a hash of its content.
+    """
+
+    buffer_size = 4 * 1024 * 1024
+    use_sendfile = True
+
+    # Set by get_content when StaticFileHandler.get wants the body, to send it afterwards
+    _content_range = None
+
+    async def get(self, path, include_body=True):
+        self._content_range = None
+        await web.StaticFileHandler.get(self, path, include_body)
+        if self._content_range is not None:
+            await self._send_content(*self._content_range)
+
+    def get_content(self, abspath, start=None, end=None):
+        """
+        Replaces the blocking read of StaticFileHandler: only remembers what to send.
+        This makes get_content an instance method, so get_content_version and compute_etag
+        are replaced too, for StaticFileHandler not to call it on the class.
+        """
+        self._content_range = (abspath, start, end)
+        return []
+
+    @staticmethod
+    def _version(stat):
+        return "%x-%x" % (stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def get_content_version(cls, abspath):
+        return cls._version(os.stat(abspath))
+
+    def compute_etag(self):
+        """
+        Identify the version of the file by its modification time and size, which needs no
+        read of the file, so that repeated views of the same file can be answered with a 304.
+        """
+        return '"%s"' % self._version(self._stat())
+
+    async def _send_content(self, abspath, start, end):
+        start = start or 0
+        stop = end if end is not None else self.get_content_size()
+        if stop <= start:
+            return
+
+        if stop - start > self.buffer_size and self._can_sendfile():
+            await self._sendfile(abspath, start, stop)
+        else:
+            await self._write_blocks(abspath, start, stop)
+
+    def _can_sendfile(self):
+        if not self.use_sendfile or not hasattr(os, "sendfile"):
+            return False
+        stream = getattr(self.request.connection, "stream", None)
+        # sendfile writes the bytes as they are, so no TLS
+        return type(stream) is iostream.IOStream
+
+    async def _sendfile(self, abspath, start, stop):
+        # Headers go through tornado, then the connection is ours to send the body
+        self.set_header("Connection", "close")
+        await self.flush()
+        stream = self.detach()
+
+        fd = await run_sync(os.open, abspath, os.O_RDONLY)
+        try:
+            await run_sync(_sendfile, stream.socket, fd, start, stop - start)
+        except OSError as e:
+            self.log.debug("Could not send %s: %s", abspath, e)
+        finally:
+            os.close(fd)
+            stream.close()
+        self.application.log_request(self)
+
+    async def _write_blocks(self, abspath, start, stop):
+        def read(offset):
+            size = min(self.buffer_size, stop - offset)
+            return asyncio.ensure_future(run_sync(os.pread, fd, size, offset))
+
+        fd = await run_sync(os.open, abspath, os.O_RDONLY)
+        pending = read(start)
+        try:
+            offset = start
+            while pending is not None:
+                block = await pending
+                pending = None
+                if not block:
+                    break
+                offset += len(block)
+                if offset < stop:
+                    pending = read(offset)
+                try:
+                    self.write(block)
+                    await self.flush()
+                except iostream.StreamClosedError:
+                    return
+        finally:
+            # The file can only be closed once no thread reads it anymore
+            if pending is not None:
+                await asyncio.gather(pending, return_exceptions=True)
+            os.close(fd)
+
+
+class SwanAuthenticatedFileHandler(LargeFileMixin, AuthenticatedFileHandler):
     """
     Wrap AuthenticatedFileHandler to convert the virtual swan_sharing_folder
     into a valid EOS path.
     Used to access other users paths.
     """
 
-    def initialize(self, path, default_path=None, default_filename=None):
+    def initialize(
+        self,
+        path,
+        default_path=None,
+        default_filename=None,
+        buffer_size=None,
+        use_sendfile=None,
+    ):
         self.root = os.path.abspath(path) + os.path.sep
         self.default_filename = default_filename
         self.default_path = default_path
-        self.eosbasepath_format = os.getenv(
-            "EOS_PATH_FORMAT", "/eos/user/{username[0]}/{username}/"
-        )
+        self.shared_path_resolver = get_shared_path_resolver()
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        if use_sendfile is not None:
+            self.use_sendfile = use_sendfile
 
     @web.authenticated
-    def get(self, path):
+    async def get(self, path, include_body=True):
         if self.root.startswith("/eos/"):
-            if path.startswith("swan_sharing_folder/"):
-                path = path.split("/")
-                user_basepath = self.eosbasepath_format.format(username=path[1])
-                path = url_path_join(user_basepath, "SWAN_projects", *(path[2:]))
+            shared_path = self.shared_path_resolver.resolve(path)
+            if shared_path is not None:
+                path = shared_path
             else:
                 path = url_path_join(self.default_path, path)
 
-        return super(AuthenticatedFileHandler, self).get(path)
+        await super().get(path, include_body)
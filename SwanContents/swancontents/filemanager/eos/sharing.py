@@ -0,0 +1,47 @@
+from functools import lru_cache
+from tornado.web import HTTPError
+import os
+import re
+
+swan_sharing_folder = 'swan_sharing_folder/'
+
+# swan_sharing_folder/<owner>/<path inside the owner's SWAN_projects>
+SharedPathRE = re.compile(r'^swan_sharing_folder/(?P<owner>[^/]+)/(?P<path>.*)$')
+
+
+class SharedPathResolver:
+    """
+    Converts the virtual swan_sharing_folder paths into the EOS paths of the projects of their owners.
+    The base path of each owner is only formatted once.
+    """
+
+    def __init__(self, eos_path_format, cache_size=256):
+        self.eos_path_format = eos_path_format
+        self._get_projects_path = lru_cache(maxsize=cache_size)(self._format_projects_path)
+
+    def _format_projects_path(self, owner):
+        user_basepath = self.eos_path_format.format(username=owner)
+        return user_basepath.rstrip('/') + '/SWAN_projects'
+
+    def resolve(self, path):
+        """
+        Returns the EOS path of a swan_sharing_folder path, or None if the path is not inside that folder
+        """
+        if not path.startswith(swan_sharing_folder):
+            return None
+
+        match = SharedPathRE.match(path)
+        if match is None or match.group('owner') in ('.', '..'):
+            raise HTTPError(404)
+
+        projects_path = self._get_projects_path(match.group('owner'))
+        path = match.group('path').strip('/')
+        return projects_path + '/' + path if path else projects_path
+
+
+@lru_cache(maxsize=None)
+def get_shared_path_resolver():
+    """ Returns the resolver shared by the contents manager and the files handler """
+    return SharedPathResolver(
+        os.getenv('EOS_PATH_FORMAT', '/eos/user/{username[0]}/{username}/')
+    )
@@ -6,22 +6,38 @@
 import re
 import requests
 import string
+import threading
+import time
 from urllib import parse
 
 from tornado import web
+from traitlets import Dict, List, observe
+from traitlets.config import Configurable
 
 CERNBoxPrefix = 'https://cernbox.cern.ch/index.php/s'
 CERNBoxPrefixTesting = 'https://cernboxwebpreview.cern.ch/index.php/s'
 EOSUserPrefix = 'file://eos/'
 LocalPrefix = 'local:'
 EOSUserRE = '/eos/(docker/|up2u/)?(user/[a-z]|home-[a-z])/([a-z0-9]+)'
-GitlabRE = '^https://(.+:.+@)?gitlab\.cern\.ch'
+GitlabRE = r'^https://(.+:.+@)?gitlab\.cern\.ch'
+
+# Seconds during which the result of checking that a URL is reachable is re-used
+CheckedURLsTTL = 60
+
+# Result of the latest checks, by URL: (expiry time, status code, response headers)
+_checked_urls = {}
+_checked_urls_lock = threading.Lock()
+
+def get_name_from_headers(headers):
+    """Return the name of the file in the Content-Disposition header, or None if there is none"""
+    hdr = headers.get('Content-Disposition')
+    match = re.search('filename="(.*)"$', hdr) if hdr else None
+    if not match:
+        return None
+    return parse.unquote_plus(match.group(1))
 
 def get_name_from_shared_from_link(r):
-    hdr = r.raw.getheader('Content-Disposition')
-    encodedName = re.search('filename="(.*)"$',hdr).group(1)
-    finalFilename = parse.unquote_plus(encodedName)
-    return finalFilename
+    return get_name_from_headers(r.headers)
 
 def is_cernbox_shared_link(proj_name):
     return (proj_name.startswith(CERNBoxPrefix) or proj_name.startswith(CERNBoxPrefixTesting)) and 'download' in proj_name
@@ -48,77 +64,179 @@ def get_path_without_eos_base(eos_path):
     except AttributeError:
         return ""
 
+GoodChars = frozenset(string.ascii_lowercase +
+                      string.ascii_uppercase +
+                      string.digits +
+                      '/._+-')
+
 def has_good_chars(name, extra_chars=''):
     '''Check if contains only good characters.
     Avoid code injection: paranoia mode'''
-    allowed = string.ascii_lowercase +\
-              string.ascii_uppercase +\
-              string.digits +\
-              '/._+-' + extra_chars
+    allowed = GoodChars.union(extra_chars)
 
-    isFile=False
     if name.startswith('https:'):
         name = name[6:]
 
     if is_file_on_eos(name):
         name = name[5:]
 
-    has_allowd_chars = set(name) <= set(allowed)
-    if not has_allowd_chars: return False
+    return set(name) <= allowed
+
+def _checked_url_key(url):
+    """The same URL can be checked percent-encoded or not"""
+    return parse.unquote(url)
+
+def get_checked_url(url):
+    """Return the headers of the response obtained when checking the URL, if it was checked recently"""
+    with _checked_urls_lock:
+        checked = _checked_urls.get(_checked_url_key(url))
+    if checked and checked[0] > time.monotonic() and checked[1] == 200:
+        return checked[2]
+    return None
+
+def check_reachable(url):
+    """Return the status code of the URL and its headers, without downloading its content.
+    HEAD is used if the server supports it, otherwise a GET of the first byte.
+    Results are re-used for CheckedURLsTTL seconds."""
+    now = time.monotonic()
+    key = _checked_url_key(url)
+    with _checked_urls_lock:
+        checked = _checked_urls.get(key)
+        if checked and checked[0] > now:
+            return checked[1], checked[2]
+
+    verify = not is_cernbox_shared_link(url)
+    response = requests.head(url, allow_redirects=True, verify=verify)
+    status_code = response.status_code
+    if status_code in (405, 501):
+        # HEAD not supported by the server
+        with requests.get(url, headers={'Range': 'bytes=0-0'}, stream=True, verify=verify) as response:
+            status_code = 200 if response.status_code == 206 else response.status_code
+    headers = response.headers
+
+    with _checked_urls_lock:
+        for expired in [u for u, c in _checked_urls.items() if c[0] <= now]:
+            del _checked_urls[expired]
+        _checked_urls[key] = (now + CheckedURLsTTL, status_code, headers)
+
+    return status_code, headers
+
+def get_clone_options(partial=False, sparse=None, submodules=True):
+    """Validate the options of a git clone provided by users and return them as a dict:
+    partial (blobless clone), sparse (only check out this path of the repository)
+    and submodules (clone the submodules too)."""
+    if sparse:
+        sparse = sparse.strip('/')
+        if not has_good_chars(sparse, ' ') or sparse.startswith('-') or \
+                '..' in sparse.split('/') or '.git' in sparse.split('/'):
+            raise web.HTTPError(400, 'The path to check out from the repository is invalid.')
+    return dict(partial=partial, sparse=sparse or None, submodules=submodules)
+
+ProjectExtensions = ['.git', '.ipynb', '.zip']
+
+# Where projects can be downloaded from, in order of precedence.
+# Each source defines the regular expression matching the beginning of its URLs, the characters
+# allowed in its URLs on top of the good ones, the kinds of projects accepted (by extension or by
+# a string the URL contains) and whether the URL must be checked to be reachable.
+DefaultSources = [
+    dict(name='gitlab', pattern=GitlabRE[1:], extra_chars=':@', extensions=ProjectExtensions),
+    dict(name='github', pattern=re.escape('https://github.com'), extensions=ProjectExtensions),
+    dict(name='github_raw', pattern=re.escape('https://raw.githubusercontent.com'), extensions=ProjectExtensions),
+    dict(name='root', pattern=re.escape('https://root.cern'), extensions=ProjectExtensions),
+    dict(name='gallery', pattern=re.escape('https://swan-gallery.web.cern.ch'), extensions=ProjectExtensions),
+    dict(name='cernbox', pattern=re.escape(CERNBoxPrefix), extra_chars='?=',
+         extensions=ProjectExtensions, contains=['download']),
+    dict(name='cernbox_testing', pattern=re.escape(CERNBoxPrefixTesting), extra_chars='?=',
+         extensions=ProjectExtensions, contains=['download']),
+    dict(name='eos', pattern=re.escape(EOSUserPrefix), extra_chars=' ()', extensions=ProjectExtensions, remote=False),
+    dict(name='local', pattern=re.escape(LocalPrefix), extra_chars=' ():', extensions=None, remote=False),
+]
+
+
+class URLChecker(Configurable):
+    """
+    Checks the URLs of the projects to download against an allowlist of sources.
+    The sources are compiled once into a single regular expression.
+    """
+
+    sources = List(
+        Dict(),
+        default_value=DefaultSources,
+        config=True,
+        help="""Sources projects can be downloaded from. Each one is a dict with:
+        'name', 'pattern' (regular expression matching the beginning of the URLs),
+        'extra_chars' (characters allowed on top of letters, digits and '/._+-'),
+        'extensions' (file extensions of the projects accepted, None for any),
+        'contains' (strings that make the URL accepted whatever its extension) and
+        'remote' (whether to check that the URL is reachable, True by default).""",
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._compile(self.sources)
+
+    @observe('sources')
+    def _sources_changed(self, change):
+        self._compile(change['new'])
+
+    def _compile(self, sources):
+        self._matcher = re.compile('|'.join(
+            '(?P<s%d>%s)' % (i, source['pattern']) for i, source in enumerate(sources)
+        ))
+        self._rules = {
+            's%d' % i: dict(
+                name=source['name'],
+                allowed=GoodChars.union(source.get('extra_chars', '')),
+                extensions=tuple(source['extensions']) if source.get('extensions') is not None else None,
+                contains=tuple(source.get('contains', ())),
+                remote=source.get('remote', True),
+            )
+            for i, source in enumerate(sources)
+        }
+
+    def check_syntax(self, url):
+        """Check that the URL is from an allowed source, with allowed characters and
+        pointing to an allowed kind of project. Returns the rule of its source."""
+
+        match = self._matcher.match(url)
+        if not match:
+            raise web.HTTPError(400, 'The URL of the project is not a github, CERN gitlab, CERNBox shared link nor root.cern.ch URL. It is not a path on EOS either.')
+        rule = self._rules[match.lastgroup]
+
+        # Check the chars, outside of the scheme
+        name = url
+        if name.startswith('https:'):
+            name = name[6:]
+        elif name.startswith(EOSUserPrefix):
+            name = name[5:]
+        if not rule['allowed'].issuperset(name):
+            raise web.HTTPError(400, 'The URL of the project is invalid (some of its characters are not accepted).')
+
+        # Limit the kind of project
+        if rule['extensions'] is not None and not url.endswith(rule['extensions']) and \
+                not any(c in url for c in rule['contains']):
+            raise web.HTTPError(400, 'The project must be a notebook or a git repository.')
+
+        return rule
+
+    def check_url(self, url):
+        url = parse.unquote(url)
+        rule = self.check_syntax(url)
+
+        # Check it exists
+        if rule['remote']:
+            sc, _ = check_reachable(url)
+            if sc != 200:
+                raise web.HTTPError(400, 'The URL of the project does not exist or is not reachable (status code is %s)' %sc)
+
+        return True
 
-    forbidden_seqs = ['&&', '|', ';', ' ', '..', '@']
-    is_valid_url = any(i in name for i in forbidden_seqs)
-    if not forbidden_seqs: return False
 
-    return True
+_default_checker = None
 
 def check_url(url):
-
-    url = parse.unquote(url)
-    gitlab_match = re.compile(GitlabRE).match(url)
-
-    # Limit the sources
-    is_good_server = gitlab_match or \
-                     url.startswith('https://github.com') or \
-                     url.startswith('https://raw.githubusercontent.com') or \
-                     url.startswith('https://root.cern.ch') or \
-                     url.startswith('https://root.cern') or \
-                     url.startswith('https://swan-gallery.web.cern.ch') or \
-                     url.startswith(CERNBoxPrefix) or \
-                     url.startswith(CERNBoxPrefixTesting) or \
-                     url.startswith(EOSUserPrefix) or \
-                     url.startswith(LocalPrefix)
-    if not is_good_server:
-        raise web.HTTPError(400, 'The URL of the project is not a github, CERN gitlab, CERNBox shared link nor root.cern.ch URL. It is not a path on EOS either.')
-
-    # Check the chars
-    onEOS = is_file_on_eos(url)
-    local = url.startswith(LocalPrefix)
-    cernbox = url.startswith(CERNBoxPrefix) or url.startswith(CERNBoxPrefixTesting)
-
-    extra_chars = ""
-    if cernbox:
-        extra_chars = "?="
-    if onEOS:
-        extra_chars = " ()"
-    if local:
-        extra_chars = " ():"
-    if gitlab_match:
-        extra_chars = ":@"
-    has_allowed_chars = has_good_chars(url, extra_chars)
-    if not has_allowed_chars:
-        raise web.HTTPError(400, 'The URL of the project is invalid (some of its characters are not accepted).')
-
-    # Limit the kind of project
-    is_good_ext = is_good_proj_name(url)
-    if not local and not is_good_ext:
-        raise web.HTTPError(400, 'The project must be a notebook or a git repository.')
-
-    # Check it exists
-    if not onEOS and not local:
-        request = requests.get(url, verify=not is_cernbox_shared_link(url))
-        sc = request.status_code
-        if sc != 200:
-            raise web.HTTPError(400, 'The URL of the project does not exist or is not reachable (status code is %s)' %sc)
-
-    return True
+    """Check the URL against the default sources"""
+    global _default_checker
+    if _default_checker is None:
+        _default_checker = URLChecker()
+    return _default_checker.check_url(url)
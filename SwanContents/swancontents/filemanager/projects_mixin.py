@@ -1,14 +1,21 @@
 
-from traitlets import HasTraits, Unicode
+from traitlets import HasTraits, Unicode, Float, Dict, Int, Instance, Any, Set, Bool, default
 from tornado import web
-import os, io, shutil, subprocess, tempfile, requests
+from anyio.to_thread import run_sync
+import asyncio, json, os, re, shutil, tempfile, requests, time, zipfile
 from .proj_url_checker import (
     is_cernbox_shared_link,
-    get_name_from_shared_from_link,
+    get_name_from_headers,
+    get_checked_url,
+    get_clone_options,
     is_file_on_eos,
     get_eos_username,
     get_path_without_eos_base
 )
+from .download_jobs import DownloadJob, parse_git_progress
+from .download_cache import DownloadCache
+from urllib import parse
+from ..utils import LRUStore
 
 
 class InvalidProject(Exception):
@@ -28,6 +35,88 @@ class ProjectsMixin(HasTraits):
         help="The base name used when creating untitled projects."
     )
 
+    project_index_ttl = Float(60, config=True,
+        help="""Seconds during which a cached lookup of whether a folder is a project root is trusted.
+        Changes made through the contents manager invalidate the cache immediately; this only bounds
+        how long changes made outside of Jupyter (e.g. from CERNBox) can go unnoticed."""
+    )
+
+    max_download_jobs = Int(2, config=True,
+        help="Maximum number of projects downloaded at the same time, the next ones wait for their turn."
+    )
+
+    download_jobs_size = Int(100, config=True,
+        help="Number of download jobs (running or finished) whose status can be queried."
+    )
+
+    download_chunk_size = Int(1024 * 1024, config=True,
+        help="Size of the chunks in which downloaded files are received and written."
+    )
+
+    download_max_size = Int(2 * 1024 ** 3, config=True,
+        help="Maximum size, in bytes, of a file downloaded from a URL."
+    )
+
+    download_spool_size = Int(16 * 1024 ** 2, config=True,
+        help="Size up to which a downloaded file is kept in memory before being spooled to a temporary file on disk."
+    )
+
+    zip_max_member_size = Int(1024 ** 3, config=True,
+        help="Maximum size, in bytes, of each file extracted from a downloaded zip."
+    )
+
+    zip_max_ratio = Int(100, config=True,
+        help="Maximum compression ratio of each file extracted from a downloaded zip, to refuse zip bombs."
+    )
+
+    download_cache_dir = Unicode(os.path.join(tempfile.gettempdir(), 'swan-download-cache'), config=True,
+        help="Node-local folder where downloaded files and cloned repositories are cached, to be re-used by the next imports."
+    )
+
+    download_cache_max_bytes = Int(1024 ** 3, config=True,
+        help="Maximum size of the download cache, in bytes. The least recently used downloads are evicted first. 0 disables the cache."
+    )
+
+    download_cache_shared = Bool(False, config=True,
+        help="""Share the download cache with the servers of the other users of the node, which must
+        use the same download_cache_dir (e.g. a folder mounted in all of them). Every user can then read
+        the downloads and add new ones, so it must only be enabled if they trust each other.
+        Otherwise, the cache is only readable by the user of the server."""
+    )
+
+    _download_cache = Instance(DownloadCache, allow_none=True)
+
+    @default('_download_cache')
+    def _download_cache_default(self):
+        if not self.download_cache_dir or self.download_cache_max_bytes <= 0:
+            return None
+        try:
+            return DownloadCache(self.download_cache_dir, self.download_cache_max_bytes, log=self.log,
+                                 shared=self.download_cache_shared)
+        except OSError as e:
+            self.log.warning("Download cache disabled, cannot use %s: %s", self.download_cache_dir, e)
+            return None
+
+    _download_jobs = Instance(LRUStore)
+
+    @default('_download_jobs')
+    def _download_jobs_default(self):
+        # The jobs still running are never forgotten
+        return LRUStore('download_jobs', self.download_jobs_size, can_evict=lambda job: job.finished)
+
+    # Jobs running in the background, referenced until they finish so they are not garbage collected
+    _download_tasks = Set()
+
+    # Created on first use, to be bound to the running event loop
+    _download_slots = Any(None)
+
+    # Maps API paths inside SWAN_projects to a (is_project_root, lookup_time) tuple,
+    # to avoid stat'ing the .swanproject file of every parent folder on each listing
+    _project_index = Dict()
+
+    # Maps the API paths of the folders whose sub-folders were indexed together to the time they were
+    _indexed_folders = Dict()
+
     @property
     def swan_home(self):
         """Absolute path to the user home which contains SWAN_projects
@@ -39,7 +128,64 @@ class ProjectsMixin(HasTraits):
             return os.path.join(self.root_dir, self.preferred_dir)
         return self.root_dir
 
-    def _get_project_path(self, path):
+    async def _is_project_root(self, path):
+        """ Check if the API path provided is the root of a project, using the project index when possible """
+
+        entry = self._project_index.get(path)
+        if entry is not None and entry[1] + self.project_index_ttl > time.monotonic():
+            return entry[0]
+
+        is_root = await self._is_file_async(self._get_os_path(os.path.join(path, self.swan_default_file)))
+        self._project_index[path] = (is_root, time.monotonic())
+        return is_root
+
+    async def _index_projects(self, path):
+        """ Find which sub-folders of the API path provided are projects and store them in the project index.
+            The folder is read with a single scandir and the .swanproject of the sub-folders that are not
+            in the index (or expired) is probed concurrently, so that listing SWAN_projects does not stat
+            each child one after the other. The children found later are looked up one by one.
+        """
+
+        now = time.monotonic()
+        indexed = self._indexed_folders.get(path)
+        if indexed is not None and indexed + self.project_index_ttl > now:
+            return
+
+        os_path = self._get_os_path(path)
+
+        def list_dirs():
+            with os.scandir(os_path) as entries:
+                return [entry.name for entry in entries if entry.is_dir()]
+
+        def is_fresh(name):
+            entry = self._project_index.get(f'{path}/{name}')
+            return entry is not None and entry[1] + self.project_index_ttl > now
+
+        names = [name for name in await self._run_on_eos('scandir', list_dirs) if not is_fresh(name)]
+        found = await asyncio.gather(*[
+            self._is_file_async(os.path.join(os_path, name, self.swan_default_file)) for name in names
+        ])
+        self._indexed_folders[path] = now
+
+        now = time.monotonic()
+        for name, is_root in zip(names, found):
+            self._project_index[f'{path}/{name}'] = (is_root, now)
+
+    def _invalidate_project_index(self, path):
+        """ Forget what is known about a path and everything below it """
+
+        path = path.replace(self.root_dir+'/', '', 1).strip('/')
+        if os.path.basename(path) == self.swan_default_file:
+            path = os.path.dirname(path)
+        prefix = path + '/'
+        for known in list(self._project_index):
+            if known == path or known.startswith(prefix):
+                del self._project_index[known]
+        for known in list(self._indexed_folders):
+            if known == path or known.startswith(prefix):
+                del self._indexed_folders[known]
+
+    async def _get_project_path(self, path):
         """ Return the project path where the path provided belongs to """
 
         folders = path.replace(self.root_dir+'/', '', 1).split('/')
@@ -49,7 +195,7 @@ class ProjectsMixin(HasTraits):
         path_to_project = folders[0]
         for folder in folders[1:]:
             path_to_project += '/' + folder
-            if self._is_file(self._get_os_path(os.path.join(path_to_project, self.swan_default_file))):
+            if await self._is_project_root(path_to_project):
                 return path_to_project
 
         return None
@@ -80,7 +226,7 @@ class ProjectsMixin(HasTraits):
         model['is_project'] = False
 
         try:
-            parent_project = self._get_project_path(path)
+            parent_project = await self._get_project_path(path)
             if parent_project:
                 model['project'] = parent_project
         except InvalidProject:
@@ -117,6 +263,7 @@ class ProjectsMixin(HasTraits):
         if create_file:
             with self.perm_to_403():
                 await super()._save_file(os.path.join(os_path, self.swan_default_file), '', 'text')
+            self._invalidate_project_index(path)
 
     async def get(self, path, content=True, type=None, format=None, require_hash=False):
         """ Get info from a path"""
@@ -128,12 +275,13 @@ class ProjectsMixin(HasTraits):
 
         os_path = self._get_os_path(path)
 
-        if path == self.swan_default_folder and not self._is_dir(os_path):
-            self._mkdir(os_path)
+        if path == self.swan_default_folder and not await self._is_dir_async(os_path):
+            await self._mkdir_async(os_path)
 
-        os_path_proj = self._get_os_path(os.path.join(path, self.swan_default_file))
+        if path == self.swan_default_folder and content:
+            await self._index_projects(path)
 
-        if self._is_dir(os_path) and self._is_file(os_path_proj):
+        if await self._is_dir_async(os_path) and await self._is_project_root(path):
             if type not in (None, 'project', 'directory'):
                 raise web.HTTPError(400,
                                 u'%s is a project, not a %s' % (path, type), reason='bad type')
@@ -155,7 +303,16 @@ class ProjectsMixin(HasTraits):
             raise web.HTTPError(400, u'No file type provided')
         
         if model['type'] != 'directory' or 'is_project' not in model or not model['is_project']:
-            return await super().save(model, path)
+            if os.path.basename(path.strip('/')) != self.swan_default_file:
+                return await super().save(model, path)
+
+            # Creating the hidden file by hand also turns the folder into a project.
+            # The index is invalidated once the file is written, so that a lookup made
+            # in the meantime does not keep the folder as a non-project.
+            try:
+                return await super().save(model, path)
+            finally:
+                self._invalidate_project_index(path)
 
         path = path.strip('/')
         os_path = self._get_os_path(path)
@@ -219,44 +376,330 @@ class ProjectsMixin(HasTraits):
 
         return await super().update(model, path)
 
+    async def rename_file(self, old_path, new_path):
+        """ Rename a file or folder, forgetting the projects known under both paths """
 
-    async def move_folder(self, origin, dest, preserve=False):
-        """ Move a folder to a new location, but renames it if it already exists """
+        await super().rename_file(old_path, new_path)
+        self._invalidate_project_index(old_path)
+        self._invalidate_project_index(new_path)
 
-        # If the name exists, get a new one
-        if self._is_dir(dest):
+    async def delete_file(self, path):
+        """ Delete a file or folder, forgetting the projects known under it """
+
+        await super().delete_file(path)
+        self._invalidate_project_index(path)
+
+
+    async def _get_free_folder_name(self, dest):
+        """ Return dest, or a variant of it with a number appended if it already exists """
+
+        if await self._is_dir_async(dest):
             count = 1
-            while self._is_dir(dest + str(count)):
+            while await self._is_dir_async(dest + str(count)):
                 count += 1
             dest += str(count)
 
-        self._move(origin, dest, preserve)
+        return dest
+
+    async def _make_project(self, dest):
+        """ Make the folder a SWAN Project """
 
-        # Make the folder a SWAN Project
         await self._save_file(os.path.join(dest, self.swan_default_file), '', 'text')
+        self._invalidate_project_index(dest)
+
+    async def move_folder(self, origin, dest, preserve=False):
+        """ Move a folder to a new location, but renames it if it already exists """
+
+        # If the name exists, get a new one
+        dest = await self._get_free_folder_name(dest)
+
+        await self._move_async(origin, dest, preserve)
+        await self._make_project(dest)
 
         return dest
 
-    async def download(self, url):
-        """ Downloads a Project from git or cernbox """
+    def start_download(self, url, clone_options=None):
+        """ Start downloading a Project in the background and return the job tracking it """
+
+        job = DownloadJob(url)
+        self._download_jobs[job.id] = job
+        task = asyncio.ensure_future(self._run_download_job(job, clone_options))
+        self._download_tasks.add(task)
+        task.add_done_callback(self._download_tasks.discard)
+        return job
 
+    def get_download_job(self, job_id):
+        """ Return the job with the id provided, if it is still known """
+
+        return self._download_jobs.get(job_id)
+
+    async def _run_download_job(self, job, clone_options):
+        try:
+            model = await self.download(job.url, job, clone_options)
+        except Exception as e:
+            self.log.error(u'Error while downloading %s: %s', job.url, e)
+            # Clean the error and keep only the message
+            job.update(status=DownloadJob.ERROR, error=e.log_message if isinstance(e, web.HTTPError) else str(e))
+        else:
+            job.update(status=DownloadJob.DONE, model=model)
+
+    def _get_download_slots(self):
+        if self._download_slots is None:
+            self._download_slots = asyncio.Semaphore(self.max_download_jobs)
+        return self._download_slots
+
+    async def download(self, url, job=None, clone_options=None):
+        """ Downloads a Project from git or cernbox
+            The download runs without blocking the server, and reports its progress to the job, if provided.
+            The clone options (see get_clone_options) apply to git repositories.
+        """
+
+        if job is None:
+            job = DownloadJob(url)
+        if clone_options is None:
+            clone_options = get_clone_options()
+
+        async with self._get_download_slots():
+            job.update(status=DownloadJob.RUNNING)
+            return await self._download(url, job, clone_options)
+
+    async def _run_git(self, *args, job=None):
+        """ Run a git command, reporting the objects and bytes received to the job """
+
+        process = await asyncio.create_subprocess_exec(
+            'git', *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        # git rewrites its progress line using carriage returns
+        pending = b''
+        while True:
+            data = await process.stderr.read(4096)
+            if not data:
+                break
+            *lines, pending = re.split(rb'[\r\n]', pending + data)
+            for line in lines:
+                progress = parse_git_progress(line.decode(errors='replace'))
+                if progress and job:
+                    job.update(**progress)
+
+        return await process.wait()
+
+    async def _clone(self, url, dest, job, clone_options):
+        """ Clone a git repository, reporting the objects and bytes received.
+            The clone can be blobless (blobs are only fetched for the files checked out),
+            only check out a path of the repository and skip the submodules.
+        """
+
+        sparse = clone_options['sparse']
+
+        args = ['clone', '--progress', '--depth=1']
+        if clone_options['partial']:
+            args.append('--filter=blob:none')
+        if sparse:
+            args.append('--no-checkout')
+        elif clone_options['submodules']:
+            args.append('--recurse-submodules')
+
+        # Add the "--" to separate the process arguments from the url, to prevent users from passing command options
+        # in the place of the url.
+        rc = await self._run_git(*args, '--', url, dest, job=job)
+        if rc != 0 or not sparse:
+            return rc
+
+        rc = await self._run_git('-C', dest, 'sparse-checkout', 'set', '--no-cone', '--', '/' + sparse)
+        if rc == 0:
+            rc = await self._run_git('-C', dest, 'checkout', job=job)
+        if rc == 0 and clone_options['submodules']:
+            # Only the submodules inside the path checked out
+            rc = await self._run_git('-C', dest, 'submodule', 'update', '--init', '--recursive', '--depth=1', '--', sparse, job=job)
+        return rc
+
+    def _get_cache_for(self, url):
+        """ Return the download cache if the url can be cached.
+            URLs containing credentials are never cached, the cache being shared on the node.
+        """
+
+        if '@' in parse.urlsplit(url).netloc:
+            return None
+        return self._download_cache
+
+    async def _git_commit(self, *args):
+        """ Return the commit printed first by a git command, or None if it could not be found """
+
+        process = await asyncio.create_subprocess_exec(
+            'git', *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        out, _ = await process.communicate()
+        if process.returncode != 0 or not out:
+            return None
+        return out.split()[0].decode()
+
+    async def _get_remote_head(self, url):
+        """ Return the commit of the HEAD of a remote repository, or None if it could not be found """
+
+        return await self._git_commit('ls-remote', '--', url, 'HEAD')
+
+    async def _clone_cached(self, url, dest, job, clone_options):
+        """ Clone a git repository, or copy it from the download cache if its HEAD was already cloned with the same options """
+
+        cache = self._get_cache_for(url)
+        options = json.dumps(clone_options, sort_keys=True)
+        commit = await self._get_remote_head(url) if cache else None
+        if commit:
+            if await run_sync(cache.restore_tree, cache.key(url, commit, options), dest):
+                self.log.info("Using the cached clone of %s at %s", url, commit)
+                return 0
+
+        rc = await self._clone(url, dest, job, clone_options)
+
+        if rc == 0 and cache:
+            # The HEAD might have moved since it was looked up, the clone is stored under the commit it has
+            cloned = await self._git_commit('-C', dest, 'rev-parse', 'HEAD')
+            if cloned:
+                try:
+                    await run_sync(cache.store_tree, cache.key(url, cloned, options), cache.key(cloned, options), dest)
+                except OSError as e:
+                    self.log.warning("Could not cache the clone of %s: %s", url, e)
+        return rc
+
+    def _fetch(self, url, job):
+        """ Download the file in url, reporting the bytes received. Runs in a worker thread.
+            Returns the name of the file and a temporary file with its content, which is only
+            written to disk if it does not fit in download_spool_size.
+        """
+
+        too_big = "The file of the project is bigger than the maximum allowed (%s bytes)" % self.download_max_size
+
+        def get_file_name(headers):
+            if is_cernbox_shared_link(url):
+                # Fall back to the name in the URL if the server did not send one
+                return get_name_from_headers(headers) or os.path.basename(parse.urlsplit(url).path)
+            return os.path.basename(url)
+
+        def get_cache_key(headers):
+            # A version of a URL is identified by its validators, without them it cannot be cached
+            validators = [headers.get('ETag', ''), headers.get('Last-Modified', '')]
+            return cache.key(url, *validators) if cache and any(validators) else None
+
+        cache = self._get_cache_for(url)
+
+        # The URL was usually checked just before, which is enough to find it in the cache without a new request
+        checked = get_checked_url(url)
+        if checked is not None:
+            key = get_cache_key(checked)
+            cached = cache.open_file(key) if key else None
+            if cached:
+                self.log.info("Using the cached download of %s", url)
+                return get_file_name(checked), cached
+
+        with requests.get(url, stream=True) as r:
+            file_name = get_file_name(r.headers)
+
+            if checked is None:
+                key = get_cache_key(r.headers)
+                cached = cache.open_file(key) if key else None
+                if cached:
+                    self.log.info("Using the cached download of %s", url)
+                    return file_name, cached
+
+            if int(r.headers.get('Content-Length') or 0) > self.download_max_size:
+                raise web.HTTPError(400, too_big)
+
+            received = 0
+            data_file = tempfile.SpooledTemporaryFile(max_size=self.download_spool_size)
+            try:
+                for data in r.iter_content(chunk_size=self.download_chunk_size):
+                    received += len(data)
+                    if received > self.download_max_size:
+                        raise web.HTTPError(400, too_big)
+                    data_file.write(data)
+                    job.update(bytes_received=received)
+            except:
+                data_file.close()
+                raise
+
+        if key:
+            data_file.seek(0)
+            try:
+                cache.store_file(key, data_file)
+            except OSError as e:
+                self.log.warning("Could not cache the download of %s: %s", url, e)
+
+        data_file.seek(0)
+        return file_name, data_file
+
+    def _write_file(self, data_file, dest):
+        """ Write the content of a downloaded file to dest """
+
+        with open(dest, 'wb') as f:
+            shutil.copyfileobj(data_file, f, self.download_chunk_size)
+
+    def _extract_zip(self, data_file, dest_dir):
+        """ Extract a downloaded zip into dest_dir member by member, refusing the members that
+            would be written outside of dest_dir or that are too big or too compressed
+        """
+
+        with zipfile.ZipFile(data_file) as nb_zip:
+            for member in nb_zip.infolist():
+                name = os.path.normpath(member.filename)
+                if os.path.isabs(name) or name.split(os.sep)[0] == '..':
+                    raise web.HTTPError(400, u'Invalid path in the zip of the project: %s' % member.filename)
+
+                dest = os.path.join(dest_dir, name)
+                if member.is_dir():
+                    os.makedirs(dest, exist_ok=True)
+                    continue
+
+                if member.file_size > self.zip_max_member_size or \
+                        member.file_size > self.zip_max_ratio * max(member.compress_size, 1):
+                    raise web.HTTPError(400, u'The file %s in the zip of the project is too big' % member.filename)
+
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                with nb_zip.open(member) as src, open(dest, 'wb') as f:
+                    # Do not trust the sizes declared in the zip
+                    written = 0
+                    while True:
+                        data = src.read(self.download_chunk_size)
+                        if not data:
+                            break
+                        written += len(data)
+                        if written > member.file_size:
+                            raise web.HTTPError(400, u'The file %s in the zip of the project is bigger than declared' % member.filename)
+                        f.write(data)
+
+    async def _download(self, url, job, clone_options):
         model = {}
-        tmp_dir_name = tempfile.mkdtemp()
 
         if url.endswith('.git'):
-            # Use subprocess.run instead of subprocess.call as the later one is deprecated and add the "--"
-            # to separate the process arguments from the url, to prevent users from passing command options
-            # in the place of the url.
-            rc = subprocess.run(['git', 'clone', '--recurse-submodules', '--depth=1', '--', url, tmp_dir_name])
-            if rc.returncode != 0:
-                raise web.HTTPError(400, "It was not possible to clone the repo %s. Did you pass the username/token?" % url)
+            tmp_dir_name = tempfile.mkdtemp()
+            try:
+                rc = await self._clone_cached(url, tmp_dir_name, job, clone_options)
+                if rc != 0:
+                    raise web.HTTPError(400, "It was not possible to clone the repo %s. Did you pass the username/token?" % url)
+
+                sparse = clone_options['sparse']
+                if sparse and not await self._run_on_eos('exists', os.path.exists, os.path.join(tmp_dir_name, sparse)):
+                    raise web.HTTPError(404, "The path %s does not exist in the repo %s" % (sparse, url))
 
-            dest_dir_name_ext = os.path.basename(url)
-            repo_name_no_ext = os.path.splitext(dest_dir_name_ext)[0]
-            dest_dir_name = os.path.join(self.root_dir, self.swan_default_folder, repo_name_no_ext)
+                dest_dir_name_ext = os.path.basename(url)
+                repo_name_no_ext = os.path.splitext(dest_dir_name_ext)[0]
+                dest_dir_name = os.path.join(self.root_dir, self.swan_default_folder, repo_name_no_ext)
 
-            model['type'] = 'directory'
-            model['path'] = await self.move_folder(tmp_dir_name, dest_dir_name)
+                model['type'] = 'directory'
+                model['path'] = await self.move_folder(tmp_dir_name, dest_dir_name)
+            except:
+                # Do not leave the clone behind in the temporary folder
+                await run_sync(shutil.rmtree, tmp_dir_name, True)
+                raise
+
+            if sparse and await self._is_file_async(os.path.join(model['path'], sparse)):
+                # Open the file checked out, e.g. a notebook from a big repository
+                model['type'] = 'file'
+                model['path'] = os.path.join(model['path'], sparse)
 
         elif is_file_on_eos(url):
             # Opened from "Open in SWAN" button
@@ -269,7 +712,8 @@ class ProjectsMixin(HasTraits):
 
             else:
                 # Outside of user directory. Copy the file.
-                shutil.copy2(file_path, tmp_dir_name) ##### FIXME
+                tmp_dir_name = tempfile.mkdtemp()
+                await self._run_on_eos('copy', shutil.copy2, file_path, tmp_dir_name) ##### FIXME
                 file_name = file_path.split('/').pop()
                 file_name_no_ext = os.path.splitext(file_name)[0]
                 dest_dir_name = os.path.join(self.root_dir, self.swan_default_folder, file_name_no_ext)
@@ -281,16 +725,17 @@ class ProjectsMixin(HasTraits):
             path = url[6:]
             file_name = path.split('/').pop()
 
-            if os.path.isdir(path):
+            if await self._is_dir_async(path):
 
                 dest_dir_name = os.path.join(self.root_dir, self.swan_default_folder, file_name)
 
                 model['type'] = 'directory'
                 model['path'] = await self.move_folder(path, dest_dir_name, preserve=True)
 
-            elif os.path.isfile(path):
+            elif await self._is_file_async(path):
 
-                shutil.copy2(path, tmp_dir_name) ##### FIXME
+                tmp_dir_name = tempfile.mkdtemp()
+                await self._run_on_eos('copy', shutil.copy2, path, tmp_dir_name) ##### FIXME
                 file_name_no_ext = os.path.splitext(file_name)[0]
                 dest_dir_name = os.path.join(self.root_dir, self.swan_default_folder, file_name_no_ext)
 
@@ -302,34 +747,36 @@ class ProjectsMixin(HasTraits):
 
 
         else:
-            is_on_cernbox = is_cernbox_shared_link(url)
-
-            # Get the file name
-            file_name = os.path.basename(url)
-
-            # Download the file and store it with the correct name inside the temp folder
+            # Download the file and store it with the correct name inside the project folder
             # or unzip all files if it's compressed
-            r = requests.get(url, stream=True)
-            if is_on_cernbox:
-                file_name = get_name_from_shared_from_link(r)
+            file_name, data_file = await run_sync(self._fetch, url, job)
 
-            if file_name.endswith('.zip'):
-                with zipfile.ZipFile(io.BytesIO(r.content)) as nb_zip:
-                    nb_zip.extractall(tmp_dir_name)
+            with data_file:
+                is_zip = file_name.endswith('.zip')
+                if is_zip:
                     # Change to the notebook file to allow the redirection to open it
                     file_name = file_name.replace('.zip', '.ipynb')
 
-            else:
-                nb_path = os.path.join(tmp_dir_name, file_name)
-                with open(nb_path, "w+b") as nb:
-                    nb.write(r.content)
-
-            # Get the destination folder path
-            file_name_no_ext = os.path.splitext(file_name)[0]
-            dest_dir_name = os.path.join(self.root_dir, self.swan_default_folder, file_name_no_ext)
+                # Get the destination folder path
+                file_name_no_ext = os.path.splitext(file_name)[0]
+                dest_dir_name = await self._get_free_folder_name(
+                    os.path.join(self.root_dir, self.swan_default_folder, file_name_no_ext))
+
+                await self._mkdir_async(dest_dir_name)
+                try:
+                    if is_zip:
+                        await self._run_on_eos('extract', self._extract_zip, data_file, dest_dir_name)
+                    else:
+                        await self._run_on_eos('write', self._write_file, data_file, os.path.join(dest_dir_name, file_name))
+                except:
+                    # Do not leave half a project behind
+                    await self._run_on_eos('rmtree', shutil.rmtree, dest_dir_name, True)
+                    raise
+
+            await self._make_project(dest_dir_name)
 
             model['type'] = 'file'
-            model['path'] = os.path.join(await self.move_folder(tmp_dir_name, dest_dir_name), file_name)
+            model['path'] = os.path.join(dest_dir_name, file_name)
 
         model['path'] = model['path'].replace(self.root_dir, '').strip('/')
 
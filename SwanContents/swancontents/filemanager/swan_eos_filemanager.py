@@ -4,9 +4,19 @@ from .eos.fileio import SwanFileManagerMixin
 from .eos.handlers import SwanAuthenticatedFileHandler
 from .projects_mixin import ProjectsMixin
 from ..checkpoints.eoscheckpoints import EOSCheckpoints
-from traitlets import default
+from ..metrics import (
+    EOS_CALL_DURATION_SECONDS,
+    BULK_COPY_BYTES,
+    BULK_COPY_DURATION_SECONDS,
+)
+from concurrent.futures import ThreadPoolExecutor
+from traitlets import default, Bool, Int, Instance
+import asyncio
+import errno
+import functools
 import os
 import shutil
+import time
 
 
 class SwanEosFileManager(ProjectsMixin, SwanFileManagerMixin, AsyncLargeFileManager):
@@ -15,6 +25,38 @@ class SwanEosFileManager(ProjectsMixin, SwanFileManagerMixin, AsyncLargeFileMana
     Adds "Project" as a new type of folder
     """
 
+    eos_max_workers = Int(
+        default_value=8,
+        config=True,
+        help="Number of threads used to run filesystem calls on EOS without blocking the server",
+    )
+
+    bulk_copy_workers = Int(
+        default_value=16,
+        config=True,
+        help="Number of files copied at the same time when copying a folder onto EOS",
+    )
+
+    files_buffer_size = Int(
+        default_value=4 * 1024 * 1024,
+        config=True,
+        help="Size of the blocks read from EOS when serving files through /files",
+    )
+
+    files_sendfile = Bool(
+        default_value=True,
+        config=True,
+        help="Send large files served through /files with sendfile when the connection is not encrypted",
+    )
+
+    _eos_executor = Instance(ThreadPoolExecutor)
+
+    @default("_eos_executor")
+    def _eos_executor_default(self):
+        return ThreadPoolExecutor(
+            max_workers=self.eos_max_workers, thread_name_prefix="swan-eos"
+        )
+
     @default("checkpoints_class")
     def _checkpoints_class_default(self):
         return EOSCheckpoints
@@ -37,16 +79,118 @@ class SwanEosFileManager(ProjectsMixin, SwanFileManagerMixin, AsyncLargeFileMana
         os.mkdir(path)
 
     def _move(self, origin, dest, preserve):
-        if preserve:
-            return shutil.copytree(origin, dest)
-        return shutil.move(origin, dest)
+        if not preserve:
+            try:
+                # Instantaneous inside the same filesystem
+                os.rename(origin, dest)
+                return dest
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+
+        # From another filesystem, e.g. a clone in the local scratch space.
+        # The links of a local folder imported as is are followed, they would not resolve on EOS
+        self._bulk_copy(origin, dest, follow_symlinks=preserve)
+        if not preserve:
+            shutil.rmtree(origin, ignore_errors=True)
+        return dest
+
+    def _bulk_copy(self, origin, dest, follow_symlinks=False):
+        """
+        Copy a folder with many files in flight at once, since EOS FUSE has a high latency per file
+        but copes well with parallel requests. Preserves the modification times, like copytree.
+        Symlinks are copied as links, or replaced by what they point to if follow_symlinks.
+        """
+        start = time.monotonic()
+        directories = []
+        copies = []
+
+        with ThreadPoolExecutor(
+            max_workers=self.bulk_copy_workers, thread_name_prefix="swan-bulk-copy"
+        ) as pool:
+            for root, dirs, files in os.walk(origin, followlinks=follow_symlinks):
+                dest_root = os.path.join(dest, os.path.relpath(root, origin))
+                os.makedirs(dest_root, exist_ok=True)
+                directories.append((root, dest_root))
+
+                for name in files:
+                    src = os.path.join(root, name)
+                    dst = os.path.join(dest_root, name)
+                    if not follow_symlinks and os.path.islink(src):
+                        os.symlink(os.readlink(src), dst)
+                    else:
+                        copies.append(pool.submit(self._copy_file, src, dst))
+
+                if not follow_symlinks:
+                    # Copy the symlinks to directories as links, without walking them
+                    linked = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+                    for name in linked:
+                        os.symlink(os.readlink(os.path.join(root, name)), os.path.join(dest_root, name))
+                    if linked:
+                        linked = set(linked)
+                        dirs[:] = [d for d in dirs if d not in linked]
+
+            # Raise the first error, if any
+            sizes = [future.result() for future in copies]
+
+        # Creating the files changed the mtime of the folders
+        for src, dst in reversed(directories):
+            shutil.copystat(src, dst)
+
+        size = sum(sizes)
+        duration = time.monotonic() - start
+        BULK_COPY_BYTES.inc(size)
+        BULK_COPY_DURATION_SECONDS.observe(duration)
+        self.log.info(
+            "Copied %d files (%.1f MiB) to %s in %.1fs (%.1f MiB/s)",
+            len(sizes), size / 1024 ** 2, dest, duration,
+            size / 1024 ** 2 / max(duration, 1e-6),
+        )
+
+    @staticmethod
+    def _copy_file(src, dst):
+        """Copy a file of a bulk copy and return its size, taken from the source instead of EOS"""
+        shutil.copy2(src, dst)
+        return os.stat(src).st_size
+
+    async def _run_on_eos(self, operation, func, *args):
+        """
+        Run a blocking filesystem call in the EOS thread pool, so that a slow
+        answer from FUSE does not freeze the event loop, and record how long it took
+        """
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        try:
+            return await loop.run_in_executor(
+                self._eos_executor, functools.partial(func, *args)
+            )
+        finally:
+            EOS_CALL_DURATION_SECONDS.labels(operation=operation).observe(
+                time.monotonic() - start
+            )
+
+    async def _is_file_async(self, path):
+        return await self._run_on_eos("is_file", self._is_file, path)
+
+    async def _is_dir_async(self, path):
+        return await self._run_on_eos("is_dir", self._is_dir, path)
+
+    async def _mkdir_async(self, path):
+        await self._run_on_eos("mkdir", self._mkdir, path)
+
+    async def _move_async(self, origin, dest, preserve):
+        return await self._run_on_eos("move", self._move, origin, dest, preserve)
 
     def _files_handler_params_default(self):
         """
         Define the root path for tornado StaticFileHandler object
         This is necessary to open files from other users (for sharing tab)
         """
+        serving = {
+            "buffer_size": self.files_buffer_size,
+            "use_sendfile": self.files_sendfile,
+        }
         if self.swan_home.startswith("/eos/"):
-            return {"path": "/eos/", "default_path": self.root_dir}
+            return {"path": "/eos/", "default_path": self.root_dir, **serving}
         else:
-            return {"path": self.root_dir}
+            return {"path": self.root_dir, **serving}
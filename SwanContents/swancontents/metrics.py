@@ -0,0 +1,40 @@
+"""
+Prometheus metrics of SwanContents.
+They are exposed together with the Jupyter Server ones in its /metrics endpoint.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+EOS_CALL_DURATION_SECONDS = Histogram(
+    "swan_eos_call_duration_seconds",
+    "Time taken by filesystem calls made on EOS from the contents manager",
+    ["operation"],
+)
+
+SAVE_DURATION_SECONDS = Histogram(
+    "swan_save_duration_seconds",
+    "Time taken to save a file, by durability level",
+    ["durability"],
+)
+
+CACHE_ENTRIES = Gauge(
+    "swan_cache_entries",
+    "Number of entries held by the in-memory caches of the contents manager",
+    ["cache"],
+)
+
+CACHE_LOOKUPS = Counter(
+    "swan_cache_lookups",
+    "Lookups in the in-memory caches of the contents manager, by result (hit or miss)",
+    ["cache", "result"],
+)
+
+BULK_COPY_BYTES = Counter(
+    "swan_bulk_copy_bytes",
+    "Bytes copied onto EOS when importing folders",
+)
+
+BULK_COPY_DURATION_SECONDS = Histogram(
+    "swan_bulk_copy_duration_seconds",
+    "Time taken to copy a folder onto EOS when importing it",
+)
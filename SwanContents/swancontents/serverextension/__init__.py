@@ -3,7 +3,14 @@ from jupyter_server.base.handlers import path_regex
 from jupyter_server import DEFAULT_TEMPLATE_PATH_LIST
 from jupyter_server.serverapp import ServerApp
 
-from .handlers.download import DownloadHandler, FetchHandler
+from .handlers.download import (
+    DownloadHandler,
+    FetchHandler,
+    FetchJobHandler,
+    FetchJobEventsHandler,
+)
+from .handlers.checkpoints import CheckpointDiffHandler
+from ..filemanager.proj_url_checker import URLChecker
 import os
 
 
@@ -29,9 +36,18 @@ def _load_jupyter_server_extension(serverapp):
 
     web_app = serverapp.web_app
 
+    # Compiled once, with the sources configured for the server
+    web_app.settings["swan_url_checker"] = URLChecker(parent=serverapp)
+
     new_handlers = [
         (r"/api/contents/fetch", FetchHandler),
+        (r"/api/contents/fetch/jobs/(?P<job_id>\w+)", FetchJobHandler),
+        (r"/api/contents/fetch/jobs/(?P<job_id>\w+)/events", FetchJobEventsHandler),
         (r"/download", DownloadHandler),
+        (
+            r"/api/contents%s/checkpoints/(?P<checkpoint_id>[\w-]+)/diff" % path_regex,
+            CheckpointDiffHandler,
+        ),
     ]
 
     for handler in new_handlers:
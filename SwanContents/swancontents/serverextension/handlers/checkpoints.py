@@ -0,0 +1,27 @@
+from tornado import web
+
+from jupyter_server.base.handlers import APIHandler
+from jupyter_server.utils import ensure_async
+import json
+
+
+class CheckpointDiffHandler(APIHandler):
+    """
+    Handler that compares a notebook with one of its EOS versions.
+    The cell-level diff is computed by the checkpoints manager, so that
+    the versions do not need to be downloaded to preview a restore.
+    """
+
+    @web.authenticated
+    async def get(self, path, checkpoint_id):
+        path = path.strip("/")
+        checkpoints = self.contents_manager.checkpoints
+
+        if not hasattr(checkpoints, "diff_checkpoint"):
+            raise web.HTTPError(404, "Checkpoints of this contents manager cannot be compared")
+        if not path.endswith(".ipynb"):
+            raise web.HTTPError(400, "Only notebooks can be compared with their versions")
+
+        diff = await ensure_async(checkpoints.diff_checkpoint(checkpoint_id, path))
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(diff))
@@ -1,10 +1,16 @@
 from tornado import web
+from tornado.iostream import StreamClosedError
 
 from jupyter_server.base.handlers import JupyterHandler, APIHandler
 from jupyter_server.utils import ensure_async
-from ...filemanager.proj_url_checker import check_url
+from anyio.to_thread import run_sync
+from ...filemanager.proj_url_checker import check_url, get_clone_options
 import json
 
+# Seconds between two messages of the event stream when the job does not progress,
+# to keep the connection alive through proxies
+EVENTS_KEEPALIVE = 15
+
 
 class DownloadHandler(JupyterHandler):
     """Render the downloads view"""
@@ -23,8 +29,36 @@ class FetchHandler(APIHandler):
     """
     Handler for the API calls used by the fetcher.
     Asks the file manager to download the project provided and retrieves the path where it was stored.
+    GET waits for the download to finish, while POST starts it in the background and returns the job
+    that follows its progress (see FetchJobHandler and FetchJobEventsHandler).
+    Git repositories accept the options partial (blobless clone), sparse (path of the repository to
+    check out) and submodules (false to skip them), as query arguments or, for POST, in the JSON body.
     """
 
+    def _get_argument(self, name, default=None):
+        """Get an argument from the query or from the JSON body of a POST"""
+        value = self.get_query_argument(name, default=None)
+        if value is None and self.request.method == "POST" and self.request.body:
+            value = self.get_json_body().get(name)
+        return default if value is None else value
+
+    def _get_clone_options(self):
+        def as_bool(value):
+            return value if isinstance(value, bool) else str(value).lower() == "true"
+
+        return get_clone_options(
+            partial=as_bool(self._get_argument("partial", False)),
+            sparse=self._get_argument("sparse"),
+            submodules=as_bool(self._get_argument("submodules", True)),
+        )
+
+    def _check_url(self, url):
+        """Check the URL with the sources configured for the server, if any"""
+        checker = self.settings.get("swan_url_checker")
+        if checker is None:
+            return check_url(url)
+        return checker.check_url(url)
+
     def _finish_model(self, model):
         """Finish a JSON request with a model, setting relevant headers, etc."""
         self.set_header("Content-Type", "application/json")
@@ -35,11 +69,65 @@ class FetchHandler(APIHandler):
         url = self.get_query_argument("url", default=None)
         if not url:
             raise web.HTTPError(400, "No url provided")
-        check_url(url)
+        clone_options = self._get_clone_options()
+        # Checking that the URL is reachable requires a request, do not block the server meanwhile
+        await run_sync(self._check_url, url)
 
         try:
-            model = await ensure_async(self.contents_manager.download(url=url))
+            model = await ensure_async(self.contents_manager.download(url=url, clone_options=clone_options))
             self._finish_model(model)
         except Exception as e:
             # Clean the error and show only the message
             raise web.HTTPError(400, str(e))
+
+    @web.authenticated
+    async def post(self):
+        url = self._get_argument("url")
+        if not url:
+            raise web.HTTPError(400, "No url provided")
+        clone_options = self._get_clone_options()
+        # Checking that the URL is reachable requires a request, do not block the server meanwhile
+        await run_sync(self._check_url, url)
+
+        job = self.contents_manager.start_download(url, clone_options)
+        self.set_status(202)
+        self._finish_model(job.to_dict())
+
+
+class FetchJobHandler(APIHandler):
+    """Status of a download started with a POST to the fetcher"""
+
+    @web.authenticated
+    def get(self, job_id):
+        job = self.contents_manager.get_download_job(job_id)
+        if job is None:
+            raise web.HTTPError(404, "No such download: %s" % job_id)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(job.to_dict()))
+
+
+class FetchJobEventsHandler(APIHandler):
+    """Stream the progress of a download as Server-Sent Events, until it finishes"""
+
+    @web.authenticated
+    async def get(self, job_id):
+        job = self.contents_manager.get_download_job(job_id)
+        if job is None:
+            raise web.HTTPError(404, "No such download: %s" % job_id)
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        while True:
+            version = job.version
+            self.write("data: %s\n\n" % json.dumps(job.to_dict()))
+            try:
+                await self.flush()
+            except StreamClosedError:
+                # The client went away, the download goes on
+                return
+            if job.finished:
+                break
+            await job.wait_for_change(version, timeout=EVENTS_KEEPALIVE)
+
+        self.finish()
@@ -1,3 +1,5 @@
+import json
+
 from tornado import web
 from jupyter_server.base.handlers import JupyterHandler, FilesRedirectHandler
 from jupyter_server.extension.handler import (
@@ -5,8 +7,7 @@ from jupyter_server.extension.handler import (
     ExtensionHandlerJinjaMixin,
 )
 from jupyter_server.base.handlers import path_regex
-from jupyter_server.utils import ensure_async
-from nbconvert import HTMLExporter
+from jupyter_server.utils import ensure_async, url_escape, url_path_join
 
 has_voila = False
 try:
@@ -17,9 +18,46 @@ except:
     pass
 
 
-class NotebookViewerHandler(
+class BaseNotebookViewHandler(
     ExtensionHandlerJinjaMixin, ExtensionHandlerMixin, JupyterHandler
 ):
+    """
+    Common methods of the handlers of the view-only mode
+    """
+
+    @property
+    def renderer(self):
+        return self.settings["swan_notebook_renderer"]
+
+    async def _get_notebook(self, path):
+        """
+        Returns the model (without content) of the notebook, its key in the renderer
+        and the coroutine function to load its content
+        """
+        cm = self.contents_manager
+        model = await ensure_async(cm.get(path, content=False))
+
+        async def load():
+            model = await ensure_async(cm.get(path, content=True))
+            return model["content"]
+
+        key = self.renderer.key(path, model["last_modified"], model.get("size"))
+        return model, key, load
+
+    def _view_url(self, endpoint, path):
+        return url_path_join(self.base_url, endpoint, url_escape(path))
+
+    def _get_int_argument(self, name, default=None):
+        try:
+            value = int(self.get_argument(name, default))
+        except (TypeError, ValueError):
+            raise web.HTTPError(400, "Argument %s must be an integer" % name)
+        if value < 0:
+            raise web.HTTPError(400, "Argument %s must not be negative" % name)
+        return value
+
+
+class NotebookViewerHandler(BaseNotebookViewHandler):
     """
     Jupyter server extension to provide a view-only mode to open notebooks.
     When users receive a shared project, now they can open it and use this extension
@@ -27,17 +65,17 @@ class NotebookViewerHandler(
     them to edit the document, even without permissions to save the changes).
     This creates a new endpoint called "notebook", followed by the path to the notebook
     (the normal, editable mode, is called "notebooks").
+    Only the first cells are sent with the page, the rest is requested while scrolling.
     """
 
     @web.authenticated
     async def get(self, path=""):
         path = path.strip("/")
-        cm = self.contents_manager
 
         self.log.info("Viewing notebook %s" % path)
 
         try:
-            model = await ensure_async(cm.get(path, content=True))
+            model, key, load = await self._get_notebook(path)
         except web.HTTPError as e:
             raise
 
@@ -45,10 +83,9 @@ class NotebookViewerHandler(
             # not a notebook, redirect to files
             return FilesRedirectHandler.redirect_to_files(self, path)
 
-        html_exporter = HTMLExporter()
-        html_exporter.template_name = "classic"
-
-        (body, resources) = html_exporter.from_notebook_node(model["content"])
+        rendered = await self.renderer.render(
+            key, load, output_url=self._view_url("notebook-output", path)
+        )
 
         name = path.rsplit("/", 1)[-1]
 
@@ -65,8 +102,10 @@ class NotebookViewerHandler(
                 "notebook_view.html",
                 notebook_name=name,
                 path=original_path,
-                notebook=body,
-                resources=resources,
+                notebook=rendered["body"],
+                resources={"inlining": {"css": rendered["css"]}},
+                next_cell=rendered.get("next"),
+                cells_url=self._view_url("notebook-cells", original_path),
                 voila=has_voila,
                 clone_url=path,
                 base_url=self.base_url,
@@ -75,6 +114,61 @@ class NotebookViewerHandler(
         self.finish()
 
 
+class NotebookCellsHandler(BaseNotebookViewHandler):
+    """
+    Returns the HTML of the cells of a notebook starting at the one given,
+    for the page of the view-only mode to append them when the reader gets there.
+    """
+
+    @web.authenticated
+    async def get(self, path=""):
+        path = path.strip("/")
+        start = self._get_int_argument("start")
+
+        model, key, load = await self._get_notebook(path)
+        if model["type"] != "notebook":
+            raise web.HTTPError(400, "%s is not a notebook" % path)
+
+        rendered = await self.renderer.render(
+            key, load, start=start, output_url=self._view_url("notebook-output", path)
+        )
+
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({"html": rendered["body"], "next": rendered["next"]}))
+
+
+class NotebookOutputHandler(BaseNotebookViewHandler):
+    """
+    Serves an image of the outputs of a notebook, so that the view-only mode
+    does not need to embed them all in the page.
+    """
+
+    @web.authenticated
+    async def get(self, path=""):
+        path = path.strip("/")
+        cell = self._get_int_argument("cell")
+        output = self._get_int_argument("output")
+
+        model, key, load = await self._get_notebook(path)
+        if model["type"] != "notebook":
+            raise web.HTTPError(400, "%s is not a notebook" % path)
+
+        result = await self.renderer.get_output(key, load, cell, output)
+        if result is None:
+            raise web.HTTPError(404, "No such output in %s" % path)
+
+        mime, data = result
+        self.set_header("Content-Type", mime)
+        # The url changes with the notebook, so the browser can keep it
+        if self.get_argument("v", None) == key[:16]:
+            self.set_header("Cache-Control", "private, max-age=86400, immutable")
+        # Nothing in an svg should run in the context of the server
+        self.set_header(
+            "Content-Security-Policy", "default-src 'none'; style-src 'unsafe-inline'"
+        )
+        self.finish(data)
+
+
 # -----------------------------------------------------------------------------
 # URL to handler mappings
 # -----------------------------------------------------------------------------
@@ -82,4 +176,6 @@ class NotebookViewerHandler(
 
 default_handlers = [
     (r"/notebook%s" % path_regex, NotebookViewerHandler),
+    (r"/notebook-cells%s" % path_regex, NotebookCellsHandler),
+    (r"/notebook-output%s" % path_regex, NotebookOutputHandler),
 ]
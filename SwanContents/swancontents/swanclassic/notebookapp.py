@@ -16,8 +16,11 @@ from .._version import __version__
 from jupyter_server.transutils import _i18n
 from jupyter_server.serverapp import load_handlers
 
-from traitlets import Unicode
+from traitlets import Unicode, Int, Bool
 import datetime
+import tempfile
+
+from .renderer import NotebookRenderer
 
 
 class NotebookApp(ClassicNotebookApp):
@@ -38,6 +41,48 @@ class NotebookApp(ClassicNotebookApp):
 
     default_url = Unicode("/projects").tag(config=True)
 
+    viewer_max_workers = Int(
+        2,
+        config=True,
+        help="Number of processes converting notebooks to HTML for the view-only mode (0 converts them in a thread)",
+    )
+
+    viewer_page_size = Int(
+        50,
+        config=True,
+        help="Number of cells sent at a time by the view-only mode, the rest being loaded while scrolling (0 sends them all)",
+    )
+
+    viewer_lazy_outputs = Bool(
+        True,
+        config=True,
+        help="Serve the images of the outputs separately in the view-only mode, so that they are only loaded when shown",
+    )
+
+    viewer_sources_cache_size = Int(
+        4,
+        config=True,
+        help="Number of notebooks kept in memory to serve their next cells and outputs in the view-only mode",
+    )
+
+    viewer_memory_cache_bytes = Int(
+        64 * 1024 * 1024,
+        config=True,
+        help="Maximum size of the rendered notebooks kept in memory for the view-only mode",
+    )
+
+    viewer_cache_dir = Unicode(
+        os.path.join(tempfile.gettempdir(), f"swan-viewer-cache-{os.getuid()}"),
+        config=True,
+        help="Folder where the notebooks rendered for the view-only mode are cached (only readable by the user)",
+    )
+
+    viewer_cache_max_bytes = Int(
+        256 * 1024 * 1024,
+        config=True,
+        help="Maximum size of the rendered notebooks kept on disk (0 disables the disk cache)",
+    )
+
     static_paths = [DEFAULT_STATIC_FILES_PATH, NBCLASSIC_DEFAULT_STATIC_FILES_PATH]
     template_paths = DEFAULT_TEMPLATE_PATH_LIST + NBCLASSIC_DEFAULT_TEMPLATE_PATH_LIST
 
@@ -83,5 +128,21 @@ class NotebookApp(ClassicNotebookApp):
             new_vars.update({"swan_logo_filename": "logo_swan_letters.png"})
         self.settings.update({"jinja_template_vars": new_vars})
 
+        self.settings["swan_notebook_renderer"] = NotebookRenderer(
+            max_workers=self.viewer_max_workers,
+            memory_max_bytes=self.viewer_memory_cache_bytes,
+            cache_dir=self.viewer_cache_dir,
+            cache_max_bytes=self.viewer_cache_max_bytes,
+            log=self.log,
+            page_size=self.viewer_page_size,
+            lazy_outputs=self.viewer_lazy_outputs,
+            sources_cache_size=self.viewer_sources_cache_size,
+        )
+
+    async def stop_extension(self):
+        renderer = self.settings.get("swan_notebook_renderer")
+        if renderer:
+            renderer.shutdown()
+
 
 main = launch_new_instance = NotebookApp.launch_instance
@@ -0,0 +1,278 @@
+import asyncio
+import base64
+import hashlib
+import html
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode
+
+import nbformat
+from anyio.to_thread import run_sync
+from nbconvert import HTMLExporter
+
+from ..utils import LRUStore
+
+# Outputs that are served separately, so that the browser only loads them when they are shown
+LazyMimeTypes = ("image/png", "image/jpeg", "image/gif", "image/svg+xml")
+
+# The exporters load their templates when first used, so they are built once per process
+_exporters = {}
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter(fragment):
+    if fragment not in _exporters:
+        exporter = HTMLExporter()
+        exporter.template_name = "classic"
+        if fragment:
+            # Only the cells, without the page around them
+            exporter.template_file = "base.html.j2"
+        _exporters[fragment] = exporter
+    return _exporters[fragment]
+
+
+def render_notebook(notebook, fragment=False):
+    """
+    Convert a notebook (given as a plain dict, so it can be sent to another process) to HTML.
+    Returns the body and the css that the page needs to inline.
+    """
+    with _exporter_lock:
+        body, resources = _get_exporter(fragment).from_notebook_node(
+            nbformat.from_dict(notebook)
+        )
+    return {"body": body, "css": list(resources.get("inlining", {}).get("css", []))}
+
+
+def lazy_outputs(cells, first_index, output_url, version):
+    """
+    Returns a copy of the cells with the embedded images replaced by links to output_url,
+    which the browser only requests when they are scrolled into view.
+    """
+    lazy_cells = []
+    for index, cell in enumerate(cells, first_index):
+        outputs = []
+        for output_index, output in enumerate(cell.get("outputs", [])):
+            data = output.get("data", {})
+            if any(mime in data for mime in LazyMimeTypes):
+                src = "%s?%s" % (
+                    output_url,
+                    urlencode({"cell": index, "output": output_index, "v": version}),
+                )
+                output = dict(
+                    output,
+                    data={
+                        "text/html": '<img loading="lazy" src="%s" alt="">'
+                        % html.escape(src)
+                    },
+                )
+            outputs.append(output)
+        if outputs:
+            cell = dict(cell, outputs=outputs)
+        lazy_cells.append(cell)
+    return lazy_cells
+
+
+def rendered_size(rendered):
+    """Approximate memory taken by a rendered window, in bytes"""
+    return len(rendered["body"]) + sum(len(css) for css in rendered["css"])
+
+
+class NotebookRenderer:
+    """
+    Renders notebooks for the view-only mode, caching the result in memory and on disk,
+    both bounded in bytes.
+    Entries are identified by the path, modification time and size of the notebook,
+    so a notebook that changes is simply rendered again under a new key.
+    The conversion runs in a pool of processes, so big notebooks do not block the server.
+
+    Notebooks are rendered in windows of page_size cells: the first one as a full page,
+    the next ones as fragments that the page appends while the reader scrolls.
+    """
+
+    def __init__(
+        self,
+        max_workers,
+        memory_max_bytes,
+        cache_dir,
+        cache_max_bytes,
+        log,
+        page_size=0,
+        lazy_outputs=False,
+        sources_cache_size=4,
+    ):
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.log = log
+        self.page_size = page_size
+        self.lazy_outputs = lazy_outputs
+        self._memory = LRUStore(
+            "notebook_views", memory_max_bytes, weigh=rendered_size
+        )
+        self._sources = LRUStore("notebook_sources", sources_cache_size)
+        self._pending = {}
+        self._pool = None
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+    async def render(self, key, load, start=0, output_url=None):
+        """
+        Returns the window of the notebook for the key given that starts at the cell start,
+        calling the coroutine function load to get the notebook content when it needs to be converted.
+        When output_url is given, the images are served from there instead of being embedded.
+        The result includes the index of the next window (None for the last one).
+        Concurrent requests for the same window share the same conversion.
+        """
+        stop = start + self.page_size if self.page_size > 0 else None
+        if not self.lazy_outputs:
+            output_url = None
+        render_key = self.key(key, start, stop, output_url)
+
+        rendered = self._memory.get(render_key)
+        if rendered is not None:
+            return rendered
+
+        future = self._pending.get(render_key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self._render(render_key, key, load, start, stop, output_url)
+            )
+            future.add_done_callback(lambda _: self._pending.pop(render_key, None))
+            self._pending[render_key] = future
+        # A client going away must not cancel the conversion for the others
+        return await asyncio.shield(future)
+
+    async def _render(self, render_key, key, load, start, stop, output_url):
+        rendered = await run_sync(self._read_disk, render_key)
+        if rendered is None:
+            notebook = await self.get_notebook(key, load)
+            cells = notebook["cells"][start:stop]
+            if output_url:
+                cells = lazy_outputs(cells, start, output_url, key[:16])
+            window = dict(notebook, cells=cells)
+
+            if self.max_workers > 0:
+                rendered = await asyncio.get_running_loop().run_in_executor(
+                    self._get_pool(), render_notebook, window, start > 0
+                )
+            else:
+                rendered = await run_sync(render_notebook, window, start > 0)
+
+            rendered["next"] = (
+                stop if stop is not None and stop < len(notebook["cells"]) else None
+            )
+            await run_sync(self._write_disk, render_key, rendered)
+        self._memory[render_key] = rendered
+        return rendered
+
+    async def get_notebook(self, key, load):
+        """
+        Returns the content of the notebook, kept for the requests of the next windows and outputs
+        """
+        notebook = self._sources.get(key)
+        if notebook is None:
+            notebook = await load()
+            self._sources[key] = notebook
+        return notebook
+
+    async def get_output(self, key, load, cell, output):
+        """
+        Returns the mime type and the bytes of an output served separately, or None if there is none
+        """
+        notebook = await self.get_notebook(key, load)
+        try:
+            data = notebook["cells"][cell]["outputs"][output]["data"]
+        except (IndexError, KeyError):
+            return None
+
+        for mime in LazyMimeTypes:
+            if mime in data:
+                value = data[mime]
+                if isinstance(value, list):
+                    value = "".join(value)
+                if mime == "image/svg+xml":
+                    return mime, value.encode()
+                return mime, base64.b64decode(value)
+        return None
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Forking a process with a running event loop and threads is not safe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _check_cache_dir(self):
+        """Creates the disk cache if needed, making sure that only the user can read it"""
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        if os.stat(self.cache_dir).st_uid != os.getuid():
+            raise PermissionError(f"{self.cache_dir} belongs to another user")
+        os.chmod(self.cache_dir, 0o700)
+
+    def _read_disk(self, key):
+        if not self.cache_max_bytes:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.stat(self.cache_dir).st_uid != os.getuid():
+                return None
+            with open(path) as f:
+                rendered = json.load(f)
+            # Keep track of the last use, for the eviction
+            os.utime(path)
+            return rendered
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, rendered):
+        if not self.cache_max_bytes:
+            return
+        path = self._disk_path(key)
+        try:
+            self._check_cache_dir()
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(rendered, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._evict()
+        except OSError as e:
+            self.log.warning("Could not cache the rendered notebook: %s", e)
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.cache_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import threading
+from .metrics import CACHE_ENTRIES, CACHE_LOOKUPS
+
+
+class LRUStore:
+    """
+    Dictionary-like store that keeps only the most recently used entries.
+    Its size and hit rate are exposed as metrics under the name given.
+    It can be used from worker threads as well as from the event loop.
+    max_size bounds the number of entries or, if weigh is given, the sum of their weights
+    (e.g. their size in bytes).
+    If can_evict is given, only the entries for which it returns True are evicted,
+    the store growing over max_size while the others are still needed.
+    """
+
+    def __init__(self, name, max_size, can_evict=None, weigh=None):
+        self.name = name
+        self.max_size = max_size
+        self.can_evict = can_evict
+        self.weigh = weigh
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """ Number of entries, or sum of their weights """
+        return self._size
+
+    def _weight(self, value):
+        return self.weigh(value) if self.weigh is not None else 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            found = key in self._entries
+            if found:
+                self._entries.move_to_end(key)
+                value = self._entries[key]
+        CACHE_LOOKUPS.labels(cache=self.name, result="hit" if found else "miss").inc()
+        return value if found else default
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._entries[key]
+            self._entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._weight(self._entries[key])
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._size += self._weight(value)
+            self._evict(key)
+            count = len(self._entries)
+        CACHE_ENTRIES.labels(cache=self.name).set(count)
+
+    def _evict(self, newest):
+        """ Remove the least recently used entries over max_size. Called with the lock held. """
+
+        if self.can_evict is None:
+            while self._entries and self._size > self.max_size:
+                _, value = self._entries.popitem(last=False)
+                self._size -= self._weight(value)
+            return
+
+        # The newest entry is kept, whatever the others are
+        for key, value in list(self._entries.items()):
+            if self._size <= self.max_size:
+                break
+            if key != newest and self.can_evict(value):
+                del self._entries[key]
+                self._size -= self._weight(value)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                value = self._entries.pop(key)
+                self._size -= self._weight(value)
+            else:
+                value = default
+            count = len(self._entries)
+        CACHE_ENTRIES.labels(cache=self.name).set(count)
+        return value
@@ -0,0 +1,141 @@
+import io
+import os
+import shutil
+import stat
+import tempfile
+
+import pytest
+
+from swancontents.filemanager.download_cache import DownloadCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DownloadCache(str(tmp_path / "cache"), 1024 ** 2)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    path = tmp_path / "repo"
+    (path / "sub").mkdir(parents=True)
+    (path / "a.ipynb").write_text("notebook")
+    (path / "sub" / "data.csv").write_text("1,2,3")
+    os.symlink("sub/data.csv", str(path / "link"))
+    return str(path)
+
+
+def test_restore_tree_copies_files(cache, repo, tmp_path):
+    key = cache.key("url", "commit")
+    cache.store_tree(key, cache.key("commit"), repo)
+
+    dest = tmp_path / "clone"
+    dest.mkdir()
+    assert cache.restore_tree(key, str(dest))
+    assert (dest / "sub" / "data.csv").read_text() == "1,2,3"
+    assert os.readlink(str(dest / "link")) == "sub/data.csv"
+
+    # Editing the project in place does not change the cached copy
+    with open(str(dest / "a.ipynb"), "w") as f:
+        f.write("edited")
+    other = tmp_path / "other"
+    other.mkdir()
+    assert cache.restore_tree(key, str(other))
+    assert (other / "a.ipynb").read_text() == "notebook"
+
+
+def test_restore_corrupted_tree(cache, repo, tmp_path):
+    key = cache.key("url", "commit")
+    object_name = cache.key("commit")
+    cache.store_tree(key, object_name, repo)
+
+    cached_file = os.path.join(cache.objects_path, object_name, "a.ipynb")
+    os.chmod(cached_file, 0o644)
+    with open(cached_file, "w") as f:
+        f.write("corrupted")
+
+    dest = tmp_path / "clone"
+    dest.mkdir()
+    assert not cache.restore_tree(key, str(dest))
+    assert os.listdir(str(dest)) == []
+    # The corrupted entry is gone, the next clone stores it again
+    assert not os.path.exists(os.path.join(cache.objects_path, object_name))
+    assert not cache.restore_tree(key, str(dest))
+
+
+def test_open_file(cache):
+    key = cache.key("url", "etag")
+    cache.store_file(key, io.BytesIO(b"content"))
+    with cache.open_file(key) as f:
+        assert f.read() == b"content"
+
+    assert cache.open_file(cache.key("url", "other")) is None
+
+
+def test_open_corrupted_file(cache):
+    key = cache.key("url", "etag")
+    cache.store_file(key, io.BytesIO(b"content"))
+    (object_name,) = [n for n in os.listdir(cache.objects_path) if not n.startswith(".tmp")]
+    with open(os.path.join(cache.objects_path, object_name), "wb") as f:
+        f.write(b"corrupted")
+
+    assert cache.open_file(key) is None
+    assert os.listdir(cache.objects_path) == []
+
+
+def test_private_cache(cache, repo):
+    cache.store_tree(cache.key("url", "commit"), cache.key("commit"), repo)
+    cache.store_file(cache.key("url", "etag"), io.BytesIO(b"content"))
+    for folder in (cache.path, cache.objects_path, cache.entries_path):
+        assert stat.S_IMODE(os.stat(folder).st_mode) == 0o700
+    for name in os.listdir(cache.entries_path):
+        assert stat.S_IMODE(os.stat(os.path.join(cache.entries_path, name)).st_mode) == 0o600
+
+
+def read_as_nobody(path, dest):
+    """In a child process running as the user nobody, read the cache and add a download to it"""
+    cache = DownloadCache(path, 1024 ** 2, shared=True)
+    with cache.open_file(cache.key("url", "etag")) as f:
+        assert f.read() == b"content"
+    assert cache.restore_tree(cache.key("url", "commit"), dest)
+    with open(os.path.join(dest, "a.ipynb")) as f:
+        assert f.read() == "notebook"
+    # Downloads can be added next to the ones of the other users
+    cache.store_file(cache.key("other", "etag"), io.BytesIO(b"other"))
+
+
+def test_shared_cache(repo):
+    """The downloads stored by the server of a user are found by the one of another user"""
+    base = tempfile.mkdtemp()
+    try:
+        os.chmod(base, 0o755)
+        path = os.path.join(base, "cache")
+        cache = DownloadCache(path, 1024 ** 2, shared=True)
+        cache.store_tree(cache.key("url", "commit"), cache.key("commit"), repo)
+        cache.store_file(cache.key("url", "etag"), io.BytesIO(b"content"))
+
+        assert stat.S_IMODE(os.stat(cache.entries_path).st_mode) == 0o1777
+        for name in os.listdir(cache.entries_path):
+            assert stat.S_IMODE(os.stat(os.path.join(cache.entries_path, name)).st_mode) == 0o644
+
+        if os.geteuid() != 0:
+            pytest.skip("Running as another user needs root")
+
+        dest = os.path.join(base, "clone")
+        os.mkdir(dest)
+        os.chown(dest, 65534, 65534)
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.setgroups([])
+                os.setgid(65534)
+                os.setuid(65534)
+                read_as_nobody(path, dest)
+                status = 0
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert cache.open_file(cache.key("other", "etag")).read() == b"other"
+    finally:
+        shutil.rmtree(base)
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+
+import pytest
+from tornado.web import HTTPError
+
+from swancontents.filemanager.eos import fileio
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        fileio, "_set_rename_version", lambda dirname, enable, log=None: calls.append((dirname, enable))
+    )
+    return calls
+
+
+def test_rename_version_shared_by_writes(calls):
+    with fileio.eos_rename_version("/eos/a"):
+        with fileio.eos_rename_version("/eos/a"):
+            pass
+        assert calls == [("/eos/a", True)]
+    assert calls == [("/eos/a", True), ("/eos/a", False)]
+    assert fileio._rename_version_users == {}
+
+
+def test_rename_version_stalled_in_another_folder(monkeypatch):
+    """A slow syscall in a folder does not hold back the writes of the others"""
+    stalled = threading.Event()
+    release = threading.Event()
+
+    def set_rename_version(dirname, enable, log=None):
+        if dirname == "/eos/slow":
+            stalled.set()
+            release.wait(5)
+
+    monkeypatch.setattr(fileio, "_set_rename_version", set_rename_version)
+
+    def slow_write():
+        with fileio.eos_rename_version("/eos/slow"):
+            pass
+
+    thread = threading.Thread(target=slow_write)
+    thread.start()
+    try:
+        assert stalled.wait(5)
+        done = threading.Event()
+
+        def fast_write():
+            with fileio.eos_rename_version("/eos/fast"):
+                pass
+            done.set()
+
+        threading.Thread(target=fast_write).start()
+        assert done.wait(1)
+    finally:
+        release.set()
+        thread.join()
+    assert fileio._rename_version_users == {}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    from swancontents.filemanager.swan_eos_filemanager import SwanEosFileManager
+
+    return SwanEosFileManager(root_dir=str(tmp_path), upload_idle_timeout=0.2)
+
+
+def chunk(manager, number, content, path="data.txt"):
+    model = {"type": "file", "format": "text", "content": content, "chunk": number}
+    return manager.save(model, path)
+
+
+def test_streamed_upload(manager, tmp_path):
+    async def upload():
+        await chunk(manager, 1, "a")
+        await chunk(manager, 2, "b")
+        # The file only appears once the last chunk arrives
+        assert not (tmp_path / "data.txt").exists()
+        assert (tmp_path / ".~data.txt").exists()
+        return await chunk(manager, -1, "c")
+
+    model = asyncio.run(upload())
+    assert model["size"] == 3
+    assert (tmp_path / "data.txt").read_text() == "abc"
+    assert not (tmp_path / ".~data.txt").exists()
+
+
+def test_upload_restarted(manager, tmp_path):
+    async def upload():
+        await chunk(manager, 1, "old")
+        await chunk(manager, 2, "old")
+        await chunk(manager, 1, "new")
+        await chunk(manager, -1, "!")
+
+    asyncio.run(upload())
+    assert (tmp_path / "data.txt").read_text() == "new!"
+
+
+def test_chunk_of_unknown_upload(manager, tmp_path):
+    with pytest.raises(HTTPError) as e:
+        asyncio.run(chunk(manager, 2, "b"))
+    assert e.value.status_code == 400
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_idle_upload_expires(manager, tmp_path):
+    async def upload():
+        await chunk(manager, 1, "a")
+        # Nothing else arrives, the periodic check abandons the upload
+        await asyncio.sleep(0.6)
+
+    asyncio.run(upload())
+    assert manager._uploads == {}
+    assert manager._upload_sweeper is None
+    assert list(tmp_path.iterdir()) == []
+
+    with pytest.raises(HTTPError):
+        asyncio.run(chunk(manager, -1, "b"))
@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+from tornado import web
+from tornado.testing import AsyncHTTPTestCase
+
+from swancontents.filemanager.eos.handlers import LargeFileMixin
+
+
+class FileHandler(LargeFileMixin, web.StaticFileHandler):
+    def initialize(self, path, buffer_size, use_sendfile):
+        super().initialize(path)
+        self.buffer_size = buffer_size
+        self.use_sendfile = use_sendfile
+
+
+class LargeFileMixinTest(AsyncHTTPTestCase):
+    size = 1024 * 1024 + 123
+
+    def get_app(self):
+        self.root = tempfile.mkdtemp()
+        self.content = os.urandom(self.size)
+        with open(os.path.join(self.root, "data.bin"), "wb") as f:
+            f.write(self.content)
+
+        params = {"path": self.root, "buffer_size": 64 * 1024}
+        return web.Application(
+            [
+                (r"/sendfile/(.*)", FileHandler, dict(params, use_sendfile=True)),
+                (r"/blocks/(.*)", FileHandler, dict(params, use_sendfile=False)),
+            ]
+        )
+
+    def check(self, mode, headers, expected, code):
+        response = self.fetch("/%s/data.bin" % mode, headers=headers)
+        assert response.code == code
+        assert int(response.headers["Content-Length"]) == len(expected)
+        assert response.body == expected
+
+    def test_full_file(self):
+        for mode in ("sendfile", "blocks"):
+            self.check(mode, {}, self.content, 200)
+
+    def test_ranges(self):
+        for mode in ("sendfile", "blocks"):
+            self.check(mode, {"Range": "bytes=100-199"}, self.content[100:200], 206)
+            self.check(mode, {"Range": "bytes=-10"}, self.content[-10:], 206)
+            self.check(mode, {"Range": "bytes=1000-"}, self.content[1000:], 206)
+
+    def test_unsatisfiable_range(self):
+        response = self.fetch(
+            "/blocks/data.bin", headers={"Range": "bytes=%d-" % self.size}
+        )
+        assert response.code == 416
+
+    def test_head(self):
+        response = self.fetch("/sendfile/data.bin", method="HEAD")
+        assert response.code == 200
+        assert int(response.headers["Content-Length"]) == self.size
+        assert response.body == b""
+
+    def test_not_modified(self):
+        for mode in ("sendfile", "blocks"):
+            response = self.fetch("/%s/data.bin" % mode)
+            etag = response.headers["Etag"]
+            stat = os.stat(os.path.join(self.root, "data.bin"))
+            assert etag == '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+            response = self.fetch(
+                "/%s/data.bin" % mode, headers={"If-None-Match": etag}
+            )
+            assert response.code == 304
+            assert response.body == b""
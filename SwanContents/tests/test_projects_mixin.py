@@ -0,0 +1,112 @@
+import asyncio
+import json
+import subprocess
+
+import pytest
+
+from swancontents.filemanager.download_cache import DownloadCache
+from swancontents.filemanager.download_jobs import DownloadJob
+from swancontents.filemanager.proj_url_checker import get_clone_options
+from swancontents.filemanager.swan_eos_filemanager import SwanEosFileManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    (tmp_path / "SWAN_projects" / "p1").mkdir(parents=True)
+    return SwanEosFileManager(root_dir=str(tmp_path), allow_hidden=True)
+
+
+def test_project_created_during_a_lookup(manager):
+    """A lookup made while .swanproject is being written must not be kept"""
+    save_file = manager._save_file
+
+    async def slow_save_file(*args, **kwargs):
+        assert not await manager._is_project_root("SWAN_projects/p1")
+        return await save_file(*args, **kwargs)
+
+    manager._save_file = slow_save_file
+
+    async def create():
+        await manager.save(
+            {"type": "file", "format": "text", "content": ""}, "SWAN_projects/p1/.swanproject"
+        )
+        return await manager._is_project_root("SWAN_projects/p1")
+
+    assert asyncio.run(create())
+
+
+def test_listing_only_probes_unknown_folders(manager, tmp_path):
+    (tmp_path / "SWAN_projects" / "p1" / ".swanproject").write_text("")
+    (tmp_path / "SWAN_projects" / "p2").mkdir()
+    probed = []
+    is_file_async = manager._is_file_async
+
+    async def counting_is_file_async(path):
+        probed.append(path)
+        return await is_file_async(path)
+
+    manager._is_file_async = counting_is_file_async
+
+    async def list_projects():
+        model = await manager.get("SWAN_projects")
+        return sorted(child["name"] for child in model["content"])
+
+    assert asyncio.run(list_projects()) == ["p1", "p2"]
+    first = len(probed)
+    assert first >= 2
+
+    # Listing again within the ttl does not probe the folders again
+    assert asyncio.run(list_projects()) == ["p1", "p2"]
+    assert len(probed) == first
+
+    # Only the folders whose entry expired are probed again
+    manager._indexed_folders.clear()
+    del manager._project_index["SWAN_projects/p2"]
+    probed.clear()
+    asyncio.run(manager._index_projects("SWAN_projects"))
+    assert probed == [str(tmp_path / "SWAN_projects" / "p2" / ".swanproject")]
+
+
+def git(*args, cwd=None):
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def test_clone_cached_under_the_commit_cloned(manager, tmp_path):
+    work = tmp_path / "work"
+    work.mkdir()
+    git("init", "-q", cwd=work)
+    (work / "a.ipynb").write_text("{}")
+    git("add", ".", cwd=work)
+    git("-c", "user.name=a", "-c", "user.email=a@b", "commit", "-qm", "first", cwd=work)
+    first = git("rev-parse", "HEAD", cwd=work)
+    (work / "a.ipynb").write_text("{ }")
+    git("-c", "user.name=a", "-c", "user.email=a@b", "commit", "-qam", "second", cwd=work)
+    second = git("rev-parse", "HEAD", cwd=work)
+    url = str(tmp_path / "repo.git")
+    git("clone", "-q", "--bare", str(work), url)
+
+    manager._download_cache = DownloadCache(str(tmp_path / "cache"), 1024 ** 2)
+
+    async def head_moved(url):
+        # The HEAD moves from the first commit to the second one between the lookup and the clone
+        return first
+
+    manager._get_remote_head = head_moved
+    options = get_clone_options()
+    dest = tmp_path / "clone"
+    dest.mkdir()
+
+    async def clone():
+        return await manager._clone_cached(url, str(dest), DownloadJob(url), options)
+
+    assert asyncio.run(clone()) == 0
+
+    cache = manager._download_cache
+    key = json.dumps(options, sort_keys=True)
+    other = tmp_path / "other"
+    other.mkdir()
+    assert not cache.restore_tree(cache.key(url, first, key), str(other))
+    assert cache.restore_tree(cache.key(url, second, key), str(other))
+    assert (other / "a.ipynb").read_text() == "{ }"
@@ -0,0 +1,37 @@
+import logging
+import os
+import stat
+
+from swancontents.swanclassic.renderer import NotebookRenderer
+
+
+def make_renderer(cache_dir):
+    return NotebookRenderer(
+        max_workers=1,
+        memory_max_bytes=1024,
+        cache_dir=str(cache_dir),
+        cache_max_bytes=1024 * 1024,
+        log=logging.getLogger("test"),
+    )
+
+
+def test_disk_cache_is_private(tmp_path):
+    cache_dir = tmp_path / "cache"
+    renderer = make_renderer(cache_dir)
+
+    renderer._write_disk("k", {"html": "<p>private</p>"})
+
+    assert stat.S_IMODE(os.stat(str(cache_dir)).st_mode) == 0o700
+    assert os.listdir(str(cache_dir)) == ["k.json"]
+    assert stat.S_IMODE(os.stat(str(cache_dir / "k.json")).st_mode) == 0o600
+    assert renderer._read_disk("k") == {"html": "<p>private</p>"}
+
+
+def test_disk_cache_fixes_existing_folder(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir(mode=0o755)
+    renderer = make_renderer(cache_dir)
+
+    renderer._write_disk("k", {"html": ""})
+
+    assert stat.S_IMODE(os.stat(str(cache_dir)).st_mode) == 0o700
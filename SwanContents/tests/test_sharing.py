@@ -0,0 +1,41 @@
+import pytest
+from tornado.web import HTTPError
+
+from swancontents.filemanager.eos.sharing import SharedPathResolver
+
+
+@pytest.fixture
+def resolver():
+    return SharedPathResolver("/eos/user/{username[0]}/{username}/")
+
+
+@pytest.mark.parametrize(
+    ("path", "expected"),
+    [
+        ("swan_sharing_folder/alice/", "/eos/user/a/alice/SWAN_projects"),
+        ("swan_sharing_folder/alice/Proj1", "/eos/user/a/alice/SWAN_projects/Proj1"),
+        (
+            "swan_sharing_folder/alice/Proj1/data/a.ipynb",
+            "/eos/user/a/alice/SWAN_projects/Proj1/data/a.ipynb",
+        ),
+        ("SWAN_projects/Proj1", None),
+    ],
+)
+def test_resolve(resolver, path, expected):
+    assert resolver.resolve(path) == expected
+
+
+@pytest.mark.parametrize(
+    "path", ["swan_sharing_folder/", "swan_sharing_folder/alice", "swan_sharing_folder/../x"]
+)
+def test_resolve_invalid(resolver, path):
+    with pytest.raises(HTTPError) as e:
+        resolver.resolve(path)
+    assert e.value.status_code == 404
+
+
+def test_owner_base_path_is_cached(resolver):
+    resolver.resolve("swan_sharing_folder/bob/P1/a.txt")
+    resolver.resolve("swan_sharing_folder/bob/P2/b.txt")
+    info = resolver._get_projects_path.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
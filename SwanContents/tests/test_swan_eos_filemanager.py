@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from swancontents.filemanager.swan_eos_filemanager import SwanEosFileManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return SwanEosFileManager(root_dir=str(tmp_path))
+
+
+@pytest.fixture
+def folder(tmp_path):
+    outside = tmp_path / "outside"
+    (outside / "data").mkdir(parents=True)
+    (outside / "data" / "a.csv").write_text("1,2")
+    (outside / "b.txt").write_text("b")
+
+    folder = tmp_path / "folder"
+    (folder / "sub").mkdir(parents=True)
+    (folder / "sub" / "nb.ipynb").write_text("{}")
+    os.symlink(str(outside / "data"), str(folder / "data"))
+    os.symlink(str(outside / "b.txt"), str(folder / "sub" / "b.txt"))
+    return folder
+
+
+def test_local_import_follows_symlinks(manager, folder, tmp_path):
+    dest = tmp_path / "dest"
+    manager._move(str(folder), str(dest), preserve=True)
+
+    assert (dest / "sub" / "nb.ipynb").read_text() == "{}"
+    assert not os.path.islink(str(dest / "data"))
+    assert (dest / "data" / "a.csv").read_text() == "1,2"
+    assert not os.path.islink(str(dest / "sub" / "b.txt"))
+    assert (dest / "sub" / "b.txt").read_text() == "b"
+    # The folder imported is left as it was
+    assert os.path.islink(str(folder / "data"))
+
+
+def test_bulk_copy_keeps_symlinks(manager, folder, tmp_path):
+    dest = tmp_path / "dest"
+    manager._bulk_copy(str(folder), str(dest))
+
+    assert (dest / "sub" / "nb.ipynb").read_text() == "{}"
+    assert os.readlink(str(dest / "data")) == os.readlink(str(folder / "data"))
+    assert os.readlink(str(dest / "sub" / "b.txt")) == os.readlink(str(folder / "sub" / "b.txt"))
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from swancontents.utils import LRUStore
+
+
+def test_keeps_most_recently_used():
+    store = LRUStore("test", 2)
+    store["a"] = 1
+    store["b"] = 2
+    assert store.get("a") == 1
+    store["c"] = 3
+    assert "a" in store and "c" in store
+    assert "b" not in store
+    assert store.get("b", 0) == 0
+    assert store.pop("a") == 1
+    assert len(store) == 1
+
+
+def test_concurrent_use():
+    store = LRUStore("test", 50)
+
+    def work(thread):
+        for i in range(2000):
+            store[(thread, i % 100)] = i
+            store.get((thread - 1, i % 100))
+            store.pop((thread, (i + 50) % 100))
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(work, range(8)))
+
+    assert len(store) <= 50
+    # The order of the entries is still consistent after all the evictions
+    for key in list(store._entries):
+        store[key]
+
+
+def test_only_evicts_what_can_be_evicted():
+    store = LRUStore("test", 2, can_evict=lambda value: value["finished"])
+    for key in "abc":
+        store[key] = {"finished": False}
+    assert len(store) == 3
+
+    store["a"]["finished"] = True
+    store["d"] = {"finished": True}
+    assert "a" not in store
+    assert all(key in store for key in "bcd")
+
+
+def test_bounded_by_weight():
+    store = LRUStore("test", 10, weigh=len)
+    store["a"] = "xxxx"
+    store["b"] = "xxxx"
+    assert store.size == 8
+    store["c"] = "xxxx"
+    assert "a" not in store and store.size == 8
+
+    # Replacing an entry counts only its new weight
+    store["b"] = "x"
+    assert store.size == 5
+
+    # Entries bigger than the store are not kept
+    store["d"] = "x" * 11
+    assert len(store) == 0 and store.size == 0
@@ -35,6 +35,7 @@ setup_args = dict(
     packages=setuptools.find_packages(),
     install_requires=[
         'pyzmq',
+        'prometheus_client',
     ],
     zip_safe=False,
     include_package_data=True,
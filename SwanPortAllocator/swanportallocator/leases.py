@@ -0,0 +1,110 @@
+import os, sqlite3
+
+
+def process_start_time(pid):
+    """
+        Return the start time of a process (in clock ticks since boot, from /proc), to tell it apart
+        from a later process with the same pid, or None if it cannot be known.
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The name of the command, in parenthesis, can contain spaces
+    fields = stat[stat.rfind(')') + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def is_same_process_alive(pid, start_time):
+    """ Check that the process is alive and, if known, that it's the one that started at start_time """
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return start_time is None or process_start_time(pid) in (None, start_time)
+
+
+class LeaseTable:
+    """
+        Journal of the ports leased to each client process, in a SQLite file, so that the leases
+        survive a restart of the server while the processes that hold them keep running.
+        Every change is committed when it's made.
+        The start time of the processes, which tells them apart from later ones with the same pid,
+        is found with get_start_time.
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS leases (
+            port INTEGER PRIMARY KEY,
+            pid INTEGER NOT NULL,
+            start_time INTEGER,
+            status TEXT NOT NULL,
+            time REAL NOT NULL
+        )
+    '''
+
+    def __init__(self, path, log, get_start_time=process_start_time):
+        self.path = path
+        self.log = log
+        self.get_start_time = get_start_time
+        try:
+            self.db = self._open()
+        except sqlite3.DatabaseError as e:
+            self.log.warning('Discarding unreadable port leases in %s: %s' % (path, e))
+            os.remove(path)
+            self.db = self._open()
+
+    def _open(self):
+        # Only used by the thread of the allocator, but created by the one that starts it
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(self.schema)
+        db.commit()
+        return db
+
+    def add(self, pid, ports, status, time):
+        start_time = self.get_start_time(pid)
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO leases (port, pid, start_time, status, time) VALUES (?, ?, ?, ?, ?)',
+                [(int(port), pid, start_time, status, time) for port in ports]
+            )
+            # The other ports of the client get the new status and time too
+            self.db.execute('UPDATE leases SET status = ?, time = ? WHERE pid = ?', (status, time, pid))
+
+    def remove(self, pid, ports):
+        with self.db:
+            self.db.executemany(
+                'DELETE FROM leases WHERE pid = ? AND port = ?',
+                [(pid, int(port)) for port in ports]
+            )
+
+    def remove_client(self, pid):
+        with self.db:
+            self.db.execute('DELETE FROM leases WHERE pid = ?', (pid,))
+
+    def set_status(self, pid, status):
+        with self.db:
+            self.db.execute('UPDATE leases SET status = ? WHERE pid = ?', (status, pid))
+
+    def load(self):
+        """ Return the leases, as a dict of pid -> {ports, start_time, status, time} """
+        clients = {}
+        for port, pid, start_time, status, time in self.db.execute(
+                'SELECT port, pid, start_time, status, time FROM leases ORDER BY pid, port'):
+            client = clients.setdefault(pid, {
+                'ports': [],
+                'start_time': start_time,
+                'status': status,
+                'time': time
+            })
+            client['ports'].append(port)
+        return clients
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,29 @@
+"""
+Prometheus metrics of SwanPortAllocator.
+They are exposed together with the Jupyter Server ones in its /metrics endpoint.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+REQUEST_DURATION_SECONDS = Histogram(
+    "swan_port_allocator_request_duration_seconds",
+    "Time taken to answer the requests made to the port allocator, by action",
+    ["action"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+FREE_PORTS = Gauge(
+    "swan_port_allocator_free_ports",
+    "Ports that the port allocator can give to new requests",
+)
+
+LEASED_PORTS = Gauge(
+    "swan_port_allocator_leased_ports",
+    "Ports currently given to client processes",
+)
+
+RECLAIMED_PORTS = Counter(
+    "swan_port_allocator_reclaimed_ports",
+    "Ports taken back from client processes by the housekeeping, by reason",
+    ["reason"],
+)
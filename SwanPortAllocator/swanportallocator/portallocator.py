@@ -1,4 +1,6 @@
 import os, zmq, time, threading, logging
+import asyncio, json
+import zmq.asyncio
 from enum import Enum
 import contextlib
 from socket import (
@@ -6,10 +8,27 @@ from socket import (
     SO_REUSEADDR,
     SOL_SOCKET,
     gethostname,
-    error as SocketError
 )
 
-opened_port_file = '/tmp/port_allocator'
+from .metrics import REQUEST_DURATION_SECONDS, FREE_PORTS, LEASED_PORTS, RECLAIMED_PORTS
+from .prober import LivenessProber, listening_ports
+from .portpool import PortPool
+from .leases import LeaseTable, is_same_process_alive
+
+# File where the port of the queue is written, for the clients to find it
+opened_port_file = os.environ.get('PORT_ALLOCATOR_FILE', '/tmp/port_allocator')
+
+# File where the leases are journaled, to recover them when the server restarts
+leases_file = os.environ.get('PORT_ALLOCATOR_LEASES_FILE', opened_port_file + '.db')
+
+# Seconds between two checks of the clients, to take back the ports they do not use anymore
+HOUSEKEEPING_INTERVAL = float(os.environ.get('PORT_ALLOCATOR_HOUSEKEEPING_INTERVAL', 10))
+
+# Maximum number of seconds between two checks of the ports of a client that keeps using them
+HOUSEKEEPING_MAX_BACKOFF = float(os.environ.get('PORT_ALLOCATOR_HOUSEKEEPING_MAX_BACKOFF', 300))
+
+# Seconds before a released port is given again, unless there are no other ports left
+PORT_REUSE_DELAY = float(os.environ.get('PORT_ALLOCATOR_REUSE_DELAY', 30))
 
 
 # Use enum with value and use the value throughout the code, in order
@@ -23,6 +42,7 @@ class Conn_State(Enum):
 # Errors pickable to be sent between master and clients
 class Errors(Enum):
     NO_PORTS_AVAILABLE = "no_ports_available"
+    UNKNOWN_ACTION = "unknown_action"
 
 
 # Actions pickable to be sent between master and clients
@@ -37,26 +57,54 @@ class PortAllocator(threading.Thread):
         Master service that manages all the ports allocated to the session.
         Keeps track of which processes are using them and manages the lifecycle of the ports, in order to
         allow re-utilization of the ports in case of failure or disconnection from a process.
+
+        Requests are served from a ROUTER socket on an asyncio loop, so a request never waits for
+        another one. The state is only changed from that loop; the checks of the clients, which can be slow,
+        run periodically in a thread and only decide which clients to remove.
+        Clients that keep using their ports get their ports checked less and less often.
+
+        The leases are journaled in a SQLite file. After a restart, the leases of the processes
+        that are still alive are restored and the queue is opened on the same port, if possible,
+        so that those processes can keep talking to the allocator.
     """
 
-    def __init__(self, log):
+    def __init__(self, log, housekeeping_interval=HOUSEKEEPING_INTERVAL,
+                 housekeeping_max_backoff=HOUSEKEEPING_MAX_BACKOFF, reuse_delay=PORT_REUSE_DELAY, prober=None):
         """
-            Creates a list of available ports in the session, by reading the COMPUTING_PORTS env variable,
+            Creates a pool of available ports in the session, by reading the COMPUTING_PORTS env variable,
             that should contain a comma separated list of ports.
             Starts a communication queue in one available internal port, and then listens for incoming
             requests.
         """
-        self.ports_available = []
-        ports = os.environ.get('COMPUTING_PORTS')
-        if ports is not None:
-            self.ports_available += ports.split(',')
+        self.pool = PortPool(PortAllocator.parse_ports(os.environ.get('COMPUTING_PORTS'), log),
+                             reuse_delay=reuse_delay)
         self.clients = {}
-        self.queue_port = PortAllocator.get_reserved_port()
+        # Ports of the pool found in use without a lease after a restart, kept until they are closed
+        self.held_ports = set()
         self.log = log
-
-        # Store the queue port so that the clients know where to connect
-        with open(opened_port_file, 'w+') as f:
+        self.queue_port = self._get_previous_queue_port() or PortAllocator.get_reserved_port()
+        self.prober = prober or LivenessProber(log)
+        self.housekeeping_interval = housekeeping_interval
+        self.housekeeping_max_backoff = housekeeping_max_backoff
+        self._housekeeping_task = None
+        self._housekeeping_forced = False
+
+        FREE_PORTS.set_function(lambda: self.pool.available)
+        LEASED_PORTS.set_function(lambda: self.pool.leased)
+
+        try:
+            self.leases = LeaseTable(leases_file, log)
+        except Exception as e:
+            self.log.warning('Port leases will not survive a restart, cannot use %s: %s' % (leases_file, e))
+            self.leases = None
+        self.recover_leases()
+
+        # Store the queue port so that the clients know where to connect,
+        # replacing the file at once so that they never read it half written
+        tmp_file = opened_port_file + '.tmp'
+        with open(tmp_file, 'w+') as f:
             f.write(str(self.queue_port))
+        os.replace(tmp_file, opened_port_file)
 
         super(self.__class__, self).__init__()
 
@@ -66,19 +114,22 @@ class PortAllocator(threading.Thread):
             Raises NoPortsException if there are less than 'n' free ports.
         """
 
-        if len(self.ports_available) < n:
+        leased_ports = self.pool.acquire(n)
+        if leased_ports is None:
             raise NoPortsException
 
         stored_ports = self.clients[process]['ports'] if process in self.clients else []
 
-        assigned_ports = self.ports_available[:n]
-        del self.ports_available[:n]
+        # The clients get the ports as strings, as in COMPUTING_PORTS
+        assigned_ports = [str(p) for p in leased_ports]
 
         self.clients[process] = {
             'ports': stored_ports + assigned_ports,
             'status': Conn_State.CONNECTING.value,
             'time': time.time()
         }
+        if self.leases:
+            self.leases.add(process, assigned_ports, Conn_State.CONNECTING.value, self.clients[process]['time'])
 
         self.log.info('Requested ports for process %s: %s' % (process, assigned_ports))
         return assigned_ports
@@ -96,16 +147,26 @@ class PortAllocator(threading.Thread):
         for p in ports:
             try:
                 stored_ports.remove(p)
-                self.ports_available.append(p)
-                self.log.info(f'Port {p} from process {process} has been released')
             except ValueError:
                 self.log.warn(f'Port {p} not assigned to process {process}, not releasing port {p}')
+                continue
+            if self.leases:
+                self.leases.remove(process, [p])
+            if self.pool.release(int(p)):
+                self.log.info(f'Port {p} from process {process} has been released')
+            else:
+                self.log.warn(f'Port {p} from process {process} was not leased')
 
-    def delete_client(self, process):
+    def delete_client(self, process, reason=None):
         """ Delete a client from the list of processes and put its ports back in the list so that they're reused """
         if process in self.clients:
-            # Put the ports in the end of the list. They will be re-used in last.
-            self.ports_available.extend(self.clients[process]['ports'])
+            if reason is not None:
+                RECLAIMED_PORTS.labels(reason=reason).inc(len(self.clients[process]['ports']))
+            # The ports go to the end of the pool. They will be re-used in last.
+            for p in self.clients[process]['ports']:
+                self.pool.release(int(p))
+            if self.leases:
+                self.leases.remove_client(process)
             del self.clients[process]
             self.log.info('Deleted process %s' % process)
 
@@ -115,54 +176,211 @@ class PortAllocator(threading.Thread):
             self.clients[process]['status'] = status
             self.log.info('Update the status of process %s: %s' % (process, status))
 
-    def _check_process(self, process):
-        """ Check if at least one port assigned to this client process is being used. If not, remove the client. """
-        s = socket()
-        for port in list(self.clients[process]['ports']):
-            try:
-                s.connect((gethostname(), int(port)))
-            except SocketError:
-                pass
+            if status == Conn_State.DISCONNECTED.value:
+                self.delete_client(process, 'disconnected')
             else:
-                # at least one port is being used, so keep the process info
-                self.log.info('Process %s is using at least one requested port' % process)
-                break
-        else:
-            # no port is being used
-            self.log.info('Process %s is not using any port' % process)
-            self.delete_client(process)
-        s.close()
+                if self.leases:
+                    self.leases.set_status(process, status)
+                # Check the ports of the client soon with its new status
+                self.clients[process].pop('next_check', None)
+                self.clients[process].pop('backoff', None)
 
-    def check_given_ports_status(self):
-        """ 
-            Check the status of all registered client process.
-            If they're dead or in disconnect state, remove them immediately.
+    def find_stale_clients(self, clients, force=False):
+        """
+            Check the status of the client processes given (a copy of self.clients), without changing
+            anything, so that it can run outside of the loop.
+            Returns the clients to remove, with the reason, and the clients found using their ports.
+            If they're dead or in disconnect state, they are removed immediately.
             If they are in connect status, check if they're using any port and remove them if not.
             If they are in the connecting status, do nothing as a timer will clean that process.
+            The ports are not checked before the next_check time of the client, unless forced.
         """
-        self.log.info('Cleaning status of active processes')
+        self.log.debug('Cleaning status of active processes')
+        stale = {}
+        to_check = {}
+        now = time.time()
 
-        for process in list(self.clients.keys()):
+        for process, client in clients.items():
 
-            if self.clients[process]['status'] == Conn_State.DISCONNECTED.value:
+            if client['status'] == Conn_State.DISCONNECTED.value:
                 self.log.info('Process %s is disconnected' % process)
-                self.delete_client(process)
+                stale[process] = 'disconnected'
                 continue
 
             try:
                 os.kill(process, 0)
             except OSError:
                 self.log.info('Process %s is no longer alive' % process)
-                self.delete_client(process)
+                stale[process] = 'dead'
                 continue
 
-            if self.clients[process]['status'] == Conn_State.CONNECTED.value:
-                self._check_process(process)
+            if not force and client.get('next_check', 0) > now:
                 continue
 
-            if self.clients[process]['status'] == Conn_State.CONNECTING.value and \
-                    self.clients[process]['time'] + 60 < time.time():
-                self._check_process(process)
+            if client['status'] == Conn_State.CONNECTED.value or \
+                    (client['status'] == Conn_State.CONNECTING.value and client['time'] + 60 < now):
+                to_check[process] = client['ports']
+
+        # Check if at least one port assigned to each client process is being used, all at once
+        alive = self.prober.clients_in_use(to_check) if to_check else set()
+        for process in to_check:
+            if process in alive:
+                self.log.debug('Process %s is using at least one requested port' % process)
+            else:
+                self.log.info('Process %s is not using any port' % process)
+                stale[process] = 'unused'
+
+        return stale, alive
+
+    def _snapshot_clients(self):
+        return {
+            process: dict(client, ports=list(client['ports']))
+            for process, client in self.clients.items()
+        }
+
+    def find_closed_ports(self, ports):
+        """ Return the ports given that are not in use anymore, without changing anything """
+        in_use = self.prober.clients_in_use({port: [port] for port in ports})
+        return set(ports) - in_use
+
+    def release_held_ports(self, ports):
+        """ Put back in the pool the ports held since a restart that are not in use anymore """
+        for port in ports:
+            if port in self.held_ports:
+                self.held_ports.discard(port)
+                self.pool.release(port)
+                self.log.info('Port %s is not in use anymore, it can be given again' % port)
+
+    def check_given_ports_status(self, force=False):
+        """ Remove the client processes that are not using their ports anymore """
+        clients = self._snapshot_clients()
+        self._apply_check(clients, *self.find_stale_clients(clients, force))
+        if self.held_ports:
+            self.release_held_ports(self.find_closed_ports(set(self.held_ports)))
+
+    def _apply_check(self, clients, stale, alive):
+        now = time.time()
+        for process, client in clients.items():
+            # Skip the clients that asked for ports while they were checked
+            if process not in self.clients or self.clients[process]['ports'] != client['ports']:
+                continue
+
+            if process in stale:
+                self.delete_client(process, stale[process])
+            elif process in alive:
+                # Back off exponentially while the client keeps using its ports
+                backoff = min(
+                    self.clients[process].get('backoff', self.housekeeping_interval / 2) * 2,
+                    self.housekeeping_max_backoff
+                )
+                self.clients[process]['backoff'] = backoff
+                self.clients[process]['next_check'] = now + backoff
+
+    async def _clean_clients(self, force=False):
+        loop = asyncio.get_running_loop()
+        clients = self._snapshot_clients()
+        stale, alive = await loop.run_in_executor(None, self.find_stale_clients, clients, force)
+        self._apply_check(clients, stale, alive)
+        if self.held_ports:
+            closed = await loop.run_in_executor(None, self.find_closed_ports, set(self.held_ports))
+            self.release_held_ports(closed)
+
+    async def _housekeeping_loop(self):
+        """ Check the clients periodically, in the background of the requests """
+        while True:
+            await asyncio.sleep(self.housekeeping_interval)
+            try:
+                await self.housekeeping()
+            except Exception:
+                self.log.exception('Could not check the clients of the port allocator')
+
+    def housekeeping(self, force=False):
+        """
+            Start cleaning the clients in the background, if it's not already being done.
+            If forced, the clients backed off are checked too.
+            Returns a future that is done when the cleaning finishes.
+        """
+        task = self._housekeeping_task
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._clean_clients(force))
+        elif force and not self._housekeeping_forced:
+            # The running cleaning skips the clients backed off: check all of them after it
+            task = asyncio.ensure_future(self._clean_clients_after(task))
+        else:
+            return asyncio.shield(task)
+        self._housekeeping_task = task
+        self._housekeeping_forced = force
+        return asyncio.shield(task)
+
+    async def _clean_clients_after(self, task):
+        await asyncio.wait([task])
+        await self._clean_clients(force=True)
+
+    async def _get_ports(self, process, n):
+        if self.pool.available < n:
+            # Out of ports: try to reclaim the ones of the processes that are gone before giving up,
+            # instead of waiting for the next periodic check, even of the clients backed off
+            await self.housekeeping(force=True)
+        return self.get_ports(process, n)
+
+    def recover_leases(self):
+        """
+            Restore the leases journaled before a restart, for the client processes that are still alive.
+            The ports of the dead ones are only given again after the reuse delay.
+            The ports of the pool found listening without a lease are held until the housekeeping
+            finds them closed, so that they are not given to a process that would fail to bind them.
+        """
+        if not self.leases:
+            return
+
+        for process, lease in self.leases.load().items():
+            if not is_same_process_alive(process, lease['start_time']):
+                self.log.info('Process %s is no longer alive, not recovering its ports' % process)
+                self.leases.remove_client(process)
+                for port in lease['ports']:
+                    if self.pool.take(port):
+                        self.pool.release(port)
+                continue
+
+            # The ports that are not in COMPUTING_PORTS anymore are dropped
+            ports = [str(p) for p in lease['ports'] if self.pool.take(p)]
+            self.clients[process] = {
+                'ports': ports,
+                'status': lease['status'],
+                'time': lease['time']
+            }
+            self.log.info('Recovered ports of process %s: %s' % (process, ports))
+
+        for port in listening_ports(self.prober.files) or ():
+            if port in self.pool and self.pool.take(port):
+                self.log.info('Port %s is in use without a lease, holding it until it is closed' % port)
+                self.held_ports.add(port)
+
+    def _get_previous_queue_port(self):
+        """ Return the port of the queue before a restart, if it can be used again """
+        try:
+            with open(opened_port_file) as f:
+                port = int(f.read())
+            with contextlib.closing(socket()) as s:
+                s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+                s.bind(('', port))
+            return port
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def parse_ports(ports, log):
+        """ Parse a comma separated list of ports, skipping the invalid ones """
+        parsed = []
+        for port in (ports or '').split(','):
+            port = port.strip()
+            if not port:
+                continue
+            try:
+                parsed.append(int(port))
+            except ValueError:
+                log.warning('Ignoring invalid port %r' % port)
+        return parsed
 
     @staticmethod
     def get_reserved_port():
@@ -187,56 +405,78 @@ class PortAllocator(threading.Thread):
                 s.accept()
                 return sockname[1]
 
-    def run(self):
-        """ Main process loop to wait for port requests """
-        # Prevent this process from getting killed as, sometimes, the queue gets 
+    async def handle_request(self, message):
+        """ Answer one request of a client, returning the message to send back """
+        try:
+            if message['action'] == Actions.GET_PORT.value:
+                return {'ok': await self._get_ports(message['process'], message['n'])}
+
+            elif message['action'] == Actions.RELEASE_PORT.value:
+                self.release_ports(message['process'], message['ports'])
+                return {'ok': None}
+
+            elif message['action'] == Actions.SET_STATUS.value:
+                self.set_status(message['process'], message['status'])
+                return {'ok': None}
+
+            else:
+                return {'error': Errors.UNKNOWN_ACTION.value}
+
+        except NoPortsException:
+            return {'error': Errors.NO_PORTS_AVAILABLE.value}
+
+    async def _reply(self, zmq_socket, envelope, message):
+        start = time.perf_counter()
+        try:
+            reply = await self.handle_request(message)
+        except Exception:
+            self.log.exception('Could not handle request %s' % message)
+            reply = {'error': 'internal_error'}
+        await zmq_socket.send_multipart(envelope + [json.dumps(reply).encode()])
+        REQUEST_DURATION_SECONDS.labels(action=str(message.get('action'))).observe(
+            time.perf_counter() - start
+        )
+
+    async def serve(self):
+        """ Listen for clients requests and give them ports, each request in its own task """
+        # Prevent this process from getting killed as, sometimes, the queue gets
         # in an inconsistent state and needs to be rebuilt.
-        # Even if there are no ports, let this process live so that the clients get an 
+        # Even if there are no ports, let this process live so that the clients get an
         # error message stating that there are no available ports.
 
+        tasks = set()
+        # Keep a reference, the loop only keeps weak ones to its tasks
+        housekeeping_loop = asyncio.ensure_future(self._housekeeping_loop())
         while True:
-            context = zmq.Context()
-            zmq_socket = context.socket(zmq.REP)
+            context = zmq.asyncio.Context()
+            zmq_socket = context.socket(zmq.ROUTER)
             zmq_socket.bind("tcp://*:%s" % self.queue_port)
 
-            def send_msg(kind, content):
-                msg = {
-                    kind: content
-                }
-                zmq_socket.send_json(msg)
-
-            def send_ok(content = None):
-                send_msg('ok', content)
-
-            def send_error(content):
-                send_msg('error', content)
-
             try:
-                # Listen for clients requests and give them ports.
                 while True:
+                    # Clients use REQ sockets: [identity, empty delimiter, request]
+                    *envelope, payload = await zmq_socket.recv_multipart()
                     try:
-                        message = zmq_socket.recv_json()
-
-                        if message['action'] == Actions.GET_PORT.value:
-
-                            # Check the status of given ports to clean them if not in use
-                            self.check_given_ports_status()
-
-                            ports = self.get_ports(message['process'], message['n'])
-                            send_ok(ports)
-
-                        elif message['action'] == Actions.RELEASE_PORT.value:
-                            self.release_ports(message['process'], message['ports'])
-                            send_ok()
-
-                        elif message['action'] == Actions.SET_STATUS.value:
-                            self.set_status(message['process'], message['status'])
-                            send_ok()
-
-                    except NoPortsException:
-                        send_error(Errors.NO_PORTS_AVAILABLE.value)
+                        message = json.loads(payload)
+                    except ValueError:
+                        # The client waits for an answer, whatever it sent
+                        self.log.warning('Invalid request %r' % payload)
+                        error = {'error': Errors.UNKNOWN_ACTION.value}
+                        await zmq_socket.send_multipart(envelope + [json.dumps(error).encode()])
+                        continue
+
+                    task = asyncio.ensure_future(self._reply(zmq_socket, envelope, message))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
             except zmq.ZMQError:
-                pass
+                self.log.exception('Rebuilding the queue of the port allocator')
+            finally:
+                zmq_socket.close(linger=0)
+                context.term()
+
+    def run(self):
+        """ Main process loop to wait for port requests """
+        asyncio.run(self.serve())
 
 
 class PortAllocatorClient:
@@ -0,0 +1,183 @@
+import time
+from array import array
+
+# State of each port of the pool
+FREE = 0
+LEASED = 1
+COOLING = 2
+
+# End of a list
+NIL = -1
+
+
+class PortPool:
+    """
+        Set of ports that can be leased and released, all in constant time.
+
+        Each port has a slot in fixed integer arrays. The free ports and the ports cooling down
+        are kept in two doubly linked lists threaded through those arrays, so that any port can be
+        moved between them in O(1) and can never be in a list twice.
+        Released ports cool down for reuse_delay seconds before being handed out again (unless there
+        are no other ports left), since the process that had them might still be holding them.
+        Free ports are handed out in order: the released ones go to the end of the list.
+    """
+
+    def __init__(self, ports, reuse_delay=0, clock=time.monotonic):
+        unique_ports = list(dict.fromkeys(int(p) for p in ports))
+        size = len(unique_ports)
+
+        self.reuse_delay = reuse_delay
+        self._clock = clock
+        self._ports = array('i', unique_ports)
+        self._slots = {port: slot for slot, port in enumerate(unique_ports)}
+        self._state = bytearray(size)
+        self._released_at = array('d', bytes(8 * size))
+        self._next = array('i', range(1, size + 1))
+        self._prev = array('i', range(-1, size - 1))
+        if size:
+            self._next[-1] = NIL
+
+        # Head, tail and length of the list of each state (the leased ports are not linked)
+        self._head = {FREE: 0 if size else NIL, COOLING: NIL}
+        self._tail = {FREE: size - 1, COOLING: NIL}
+        self._count = {FREE: size, LEASED: 0, COOLING: 0}
+
+    def __len__(self):
+        return len(self._ports)
+
+    def __contains__(self, port):
+        return port in self._slots
+
+    @property
+    def available(self):
+        """ Number of ports that can be leased """
+        return self._count[FREE] + self._count[COOLING]
+
+    @property
+    def free(self):
+        return self._count[FREE]
+
+    @property
+    def cooling(self):
+        return self._count[COOLING]
+
+    @property
+    def leased(self):
+        return self._count[LEASED]
+
+    def is_leased(self, port):
+        slot = self._slots.get(port)
+        return slot is not None and self._state[slot] == LEASED
+
+    def acquire(self, n):
+        """
+            Lease n ports, the ones free for longest first.
+            Returns None, leasing nothing, if there are less than n ports available.
+        """
+        self._expire()
+        if n > self.available:
+            return None
+
+        ports = []
+        for _ in range(n):
+            state = FREE if self._head[FREE] != NIL else COOLING
+            slot = self._head[state]
+            self._move(slot, LEASED)
+            ports.append(self._ports[slot])
+        return ports
+
+    def take(self, port):
+        """
+            Lease a specific port, e.g. one found in use.
+            Returns False if the port is not in the pool or is already leased.
+        """
+        slot = self._slots.get(port)
+        if slot is None or self._state[slot] == LEASED:
+            return False
+        self._move(slot, LEASED)
+        return True
+
+    def release(self, port):
+        """
+            Give a leased port back to the pool.
+            Returns False if the port is not in the pool or is not leased, so it's never added twice.
+        """
+        slot = self._slots.get(port)
+        if slot is None or self._state[slot] != LEASED:
+            return False
+
+        if self.reuse_delay > 0:
+            self._released_at[slot] = self._clock()
+            self._move(slot, COOLING)
+        else:
+            self._move(slot, FREE)
+        return True
+
+    def _expire(self):
+        """ Move the ports that cooled down long enough to the free list """
+        limit = self._clock() - self.reuse_delay
+        while self._head[COOLING] != NIL and self._released_at[self._head[COOLING]] <= limit:
+            self._move(self._head[COOLING], FREE)
+
+    def _move(self, slot, state):
+        """ Take the slot out of the list of its current state and append it to the one of the new state """
+        old_state = self._state[slot]
+        if old_state != LEASED:
+            prev, next = self._prev[slot], self._next[slot]
+            if prev == NIL:
+                self._head[old_state] = next
+            else:
+                self._next[prev] = next
+            if next == NIL:
+                self._tail[old_state] = prev
+            else:
+                self._prev[next] = prev
+
+        self._prev[slot] = self._next[slot] = NIL
+        if state != LEASED:
+            tail = self._tail[state]
+            self._prev[slot] = tail
+            if tail == NIL:
+                self._head[state] = slot
+            else:
+                self._next[tail] = slot
+            self._tail[state] = slot
+
+        self._count[old_state] -= 1
+        self._count[state] += 1
+        self._state[slot] = state
+
+    def check_invariants(self):
+        """
+            Verify the consistency of the pool, raising AssertionError if something is wrong:
+            every port is in exactly one state, the lists are well linked, hold exactly the ports
+            in their state, and the cooling list is sorted by release time.
+        """
+        seen = set()
+        for state in (FREE, COOLING):
+            prev = NIL
+            slot = self._head[state]
+            length = 0
+            while slot != NIL:
+                if slot in seen:
+                    raise AssertionError('Port %d is linked twice' % self._ports[slot])
+                seen.add(slot)
+                if self._state[slot] != state:
+                    raise AssertionError('Port %d is in the wrong list' % self._ports[slot])
+                if self._prev[slot] != prev:
+                    raise AssertionError('Port %d is badly linked' % self._ports[slot])
+                if state == COOLING and prev != NIL and self._released_at[prev] > self._released_at[slot]:
+                    raise AssertionError('Cooling ports are not sorted by release time')
+                prev = slot
+                slot = self._next[slot]
+                length += 1
+            if self._tail[state] != prev:
+                raise AssertionError('Wrong tail of the list of state %d' % state)
+            if length != self._count[state]:
+                raise AssertionError('Wrong count of the ports of state %d' % state)
+
+        leased = [slot for slot in range(len(self._ports)) if self._state[slot] == LEASED]
+        if len(leased) != self._count[LEASED]:
+            raise AssertionError('Wrong count of leased ports')
+        if seen.intersection(leased) or len(seen) + len(leased) != len(self._ports):
+            raise AssertionError('Ports are missing from the pool')
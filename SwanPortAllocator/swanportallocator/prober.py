@@ -0,0 +1,134 @@
+import errno, os, selectors, time
+from socket import (
+    socket,
+    getaddrinfo,
+    gethostname,
+    SOCK_STREAM,
+    SOL_SOCKET,
+    SO_ERROR,
+    error as SocketError
+)
+
+# Files listing the TCP sockets of the network namespace, IPv4 and IPv6
+proc_net_tcp_files = ('/proc/net/tcp', '/proc/net/tcp6')
+
+# State of the listening sockets in those files
+TCP_LISTEN = '0A'
+
+# Seconds that a connection attempt to a port can take before considering the port unused
+PROBE_TIMEOUT = float(os.environ.get('PORT_ALLOCATOR_PROBE_TIMEOUT', 1))
+
+# Maximum number of connection attempts in flight, to stay far from the file descriptors limit
+PROBE_BATCH_SIZE = 256
+
+
+def listening_ports(files=proc_net_tcp_files):
+    """
+        Return the set of local ports with a socket in LISTEN state, read from /proc,
+        or None if the files cannot be read (i.e. not on Linux).
+    """
+    ports = set()
+    found = False
+    for path in files:
+        try:
+            f = open(path)
+        except OSError:
+            continue
+        found = True
+        with f:
+            next(f, None)  # header
+            for line in f:
+                # sl local_address rem_address st ..., with the addresses as hex ip:port
+                fields = line.split()
+                if len(fields) > 3 and fields[3] == TCP_LISTEN:
+                    ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+    return ports if found else None
+
+
+class LivenessProber:
+    """
+        Find out which client processes are still using the ports given to them.
+        Ports with a listening socket are found in /proc first; the remaining ones are probed
+        with connections to all of them at once, each one with the same deadline.
+    """
+
+    def __init__(self, log, host=None, timeout=PROBE_TIMEOUT, batch_size=PROBE_BATCH_SIZE,
+                 files=proc_net_tcp_files):
+        self.log = log
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.files = files
+        self.family, self.address = self._resolve(host or gethostname())
+
+    def _resolve(self, host):
+        """ Resolve the host only once, instead of on every connection """
+        try:
+            family, _, _, _, sockaddr = getaddrinfo(host, None, type=SOCK_STREAM)[0]
+            return family, sockaddr[0]
+        except SocketError as e:
+            self.log.warning('Could not resolve %s, probing localhost instead: %s' % (host, e))
+            family, _, _, _, sockaddr = getaddrinfo('localhost', None, type=SOCK_STREAM)[0]
+            return family, sockaddr[0]
+
+    def clients_in_use(self, clients):
+        """
+            Given a dict of process -> list of ports, return the set of processes
+            that are using at least one of their ports.
+        """
+        in_use = set()
+        listening = listening_ports(self.files)
+        to_connect = {}
+
+        for process, ports in clients.items():
+            ports = [int(p) for p in ports]
+            if listening is not None and not listening.isdisjoint(ports):
+                in_use.add(process)
+            else:
+                for port in ports:
+                    to_connect.setdefault(port, []).append(process)
+
+        if to_connect:
+            for port in self.connectable_ports(list(to_connect)):
+                in_use.update(to_connect[port])
+
+        return in_use
+
+    def connectable_ports(self, ports):
+        """ Return the set of ports that accept a connection within the timeout """
+        connectable = set()
+        for i in range(0, len(ports), self.batch_size):
+            connectable |= self._connect_batch(ports[i:i + self.batch_size])
+        return connectable
+
+    def _connect_batch(self, ports):
+        connectable = set()
+        selector = selectors.DefaultSelector()
+        try:
+            for port in ports:
+                s = socket(self.family, SOCK_STREAM)
+                s.setblocking(False)
+                result = s.connect_ex((self.address, port))
+                if result == 0:
+                    connectable.add(port)
+                    s.close()
+                elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    selector.register(s, selectors.EVENT_WRITE, port)
+                else:
+                    s.close()
+
+            deadline = time.monotonic() + self.timeout
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in selector.select(remaining):
+                    if key.fileobj.getsockopt(SOL_SOCKET, SO_ERROR) == 0:
+                        connectable.add(key.data)
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+        finally:
+            # The ones that did not answer in time
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+        return connectable
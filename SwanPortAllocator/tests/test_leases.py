@@ -0,0 +1,40 @@
+import logging
+import os
+
+from swanportallocator.leases import LeaseTable, is_same_process_alive, process_start_time
+
+
+def test_leases_survive_reopening(tmp_path):
+    path = str(tmp_path / "leases.db")
+    table = LeaseTable(path, logging.getLogger(), get_start_time={100: 1234}.get)
+    table.add(100, ["5000", "5001"], "connecting", 1.0)
+    table.add(200, ["5002"], "connecting", 2.0)
+    table.add(100, ["5003"], "connecting", 3.0)
+    table.set_status(100, "connected")
+    table.remove(100, ["5001"])
+    table.add(300, ["5004"], "connecting", 4.0)
+    table.remove_client(300)
+    table.close()
+
+    leases = LeaseTable(path, logging.getLogger()).load()
+    assert leases == {
+        100: {"ports": [5000, 5003], "start_time": 1234, "status": "connected", "time": 3.0},
+        200: {"ports": [5002], "start_time": None, "status": "connecting", "time": 2.0},
+    }
+
+
+def test_unreadable_file_is_discarded(tmp_path):
+    path = tmp_path / "leases.db"
+    path.write_bytes(b"not a database" * 100)
+    assert LeaseTable(str(path), logging.getLogger()).load() == {}
+
+
+def test_process_identity():
+    pid = os.getpid()
+    start_time = process_start_time(pid)
+    assert is_same_process_alive(pid, start_time)
+    assert is_same_process_alive(pid, None)
+    if start_time is not None:
+        # Same pid, but not the process that took the lease
+        assert not is_same_process_alive(pid, start_time - 1)
+    assert not is_same_process_alive(2 ** 22 + 1, None)
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import os
+
+import pytest
+import zmq
+from prometheus_client import REGISTRY
+
+from swanportallocator import portallocator
+from swanportallocator.leases import LeaseTable, process_start_time
+from swanportallocator.portallocator import (
+    Actions,
+    Conn_State,
+    Errors,
+    PortAllocator,
+    PortAllocatorClient,
+)
+
+# pid_max is at most 2^22, so no process can have this pid
+DEAD_PID = 2 ** 22 + 1
+
+
+class FakeProber:
+    """Prober that finds in use the processes given, recording the ones it was asked about"""
+
+    def __init__(self, files=()):
+        self.files = files
+        self.in_use = set()
+        self.checked = []
+
+    def clients_in_use(self, clients):
+        self.checked.append(dict(clients))
+        return self.in_use.intersection(clients)
+
+
+@pytest.fixture
+def make_allocator(tmp_path, monkeypatch):
+    monkeypatch.setenv("COMPUTING_PORTS", "5000,5001,5002")
+    monkeypatch.setattr(portallocator, "opened_port_file", str(tmp_path / "port_allocator"))
+    monkeypatch.setattr(portallocator, "leases_file", str(tmp_path / "leases.db"))
+    allocators = []
+
+    def make_allocator(**kwargs):
+        kwargs.setdefault("prober", FakeProber())
+        kwargs.setdefault("reuse_delay", 0)
+        allocator = PortAllocator(logging.getLogger(), **kwargs)
+        allocators.append(allocator)
+        return allocator
+
+    yield make_allocator
+    for allocator in allocators:
+        allocator.leases.close()
+
+
+@pytest.fixture
+def allocator(make_allocator):
+    return make_allocator()
+
+
+def request(allocator, **message):
+    return asyncio.run(allocator.handle_request(message))
+
+
+def reclaimed(reason):
+    return REGISTRY.get_sample_value(
+        "swan_port_allocator_reclaimed_ports_total", {"reason": reason}
+    ) or 0
+
+
+def test_get_and_release_ports(allocator):
+    pid = os.getpid()
+    assert request(allocator, action=Actions.GET_PORT.value, process=pid, n=2) == {"ok": ["5000", "5001"]}
+    assert request(allocator, action=Actions.GET_PORT.value, process=pid, n=1) == {"ok": ["5002"]}
+    assert allocator.clients[pid]["ports"] == ["5000", "5001", "5002"]
+
+    assert request(allocator, action=Actions.RELEASE_PORT.value, process=pid, ports=["5001"]) == {"ok": None}
+    assert allocator.clients[pid]["ports"] == ["5000", "5002"]
+    assert allocator.pool.available == 1
+
+    assert request(allocator, action="unknown", process=pid) == {"error": Errors.UNKNOWN_ACTION.value}
+
+
+def test_no_ports_reclaims_dead_clients(allocator):
+    allocator.get_ports(DEAD_PID, 3)
+    before = reclaimed("dead")
+
+    # The dead process is found when running out of ports, without waiting for the periodic check
+    assert request(allocator, action=Actions.GET_PORT.value, process=os.getpid(), n=2) == {"ok": ["5000", "5001"]}
+    assert DEAD_PID not in allocator.clients
+    assert reclaimed("dead") - before == 3
+
+    assert request(allocator, action=Actions.GET_PORT.value, process=os.getpid(), n=2) == {
+        "error": Errors.NO_PORTS_AVAILABLE.value
+    }
+
+
+def test_disconnected_client_is_deleted_at_once(allocator):
+    pid = os.getpid()
+    allocator.get_ports(pid, 2)
+    before = reclaimed("disconnected")
+
+    request(allocator, action=Actions.SET_STATUS.value, process=pid, status=Conn_State.DISCONNECTED.value)
+    assert pid not in allocator.clients
+    assert allocator.pool.available == 3
+    assert reclaimed("disconnected") - before == 2
+
+
+def test_housekeeping_backs_off(make_allocator):
+    allocator = make_allocator(housekeeping_interval=10, housekeeping_max_backoff=30)
+    pid = os.getpid()
+    allocator.get_ports(pid, 1)
+    allocator.set_status(pid, Conn_State.CONNECTED.value)
+    allocator.prober.in_use.add(pid)
+
+    backoffs = []
+    for _ in range(4):
+        allocator.clients[pid]["next_check"] = 0
+        allocator.check_given_ports_status()
+        backoffs.append(allocator.clients[pid]["backoff"])
+    assert backoffs == [10, 20, 30, 30]
+
+    # Not checked again before its next check
+    allocator.check_given_ports_status()
+    assert len(allocator.prober.checked) == 4
+
+    # Changing status checks it again
+    allocator.set_status(pid, Conn_State.CONNECTED.value)
+    allocator.prober.in_use.clear()
+    allocator.check_given_ports_status()
+    assert pid not in allocator.clients
+
+
+def test_no_ports_checks_clients_backed_off(make_allocator):
+    allocator = make_allocator(housekeeping_interval=10, housekeeping_max_backoff=300)
+    pid = os.getpid()
+    assert request(allocator, action=Actions.GET_PORT.value, process=pid, n=3) == {"ok": ["5000", "5001", "5002"]}
+    allocator.set_status(pid, Conn_State.CONNECTED.value)
+    allocator.prober.in_use.add(pid)
+    allocator.check_given_ports_status()
+    assert allocator.clients[pid]["next_check"] > 0
+
+    # The client closes its ports before its next check: running out of ports reclaims them
+    allocator.prober.in_use.clear()
+    assert request(allocator, action=Actions.GET_PORT.value, process=pid, n=1) == {"ok": ["5000"]}
+    assert allocator.clients[pid]["ports"] == ["5000"]
+
+
+def test_forced_housekeeping_waits_for_the_running_one(allocator):
+    pid = os.getpid()
+    allocator.get_ports(pid, 1)
+    allocator.set_status(pid, Conn_State.CONNECTED.value)
+    allocator.clients[pid]["next_check"] = float("inf")
+
+    async def check_twice():
+        await asyncio.gather(allocator.housekeeping(), allocator.housekeeping(force=True))
+
+    asyncio.run(check_twice())
+    assert allocator.prober.checked == [{pid: ["5000"]}]
+    assert pid not in allocator.clients
+def test_connecting_clients_have_a_grace_period(allocator):
+    pid = os.getpid()
+    allocator.get_ports(pid, 1)
+    allocator.check_given_ports_status()
+    assert pid in allocator.clients
+    assert allocator.prober.checked == []
+
+    allocator.clients[pid]["time"] -= 61
+    allocator.check_given_ports_status()
+    assert pid not in allocator.clients
+
+
+def test_housekeeping_runs_once_at_a_time(allocator):
+    pid = os.getpid()
+    allocator.get_ports(pid, 1)
+    allocator.set_status(pid, Conn_State.CONNECTED.value)
+
+    async def check_twice():
+        await asyncio.gather(allocator.housekeeping(), allocator.housekeeping())
+
+    asyncio.run(check_twice())
+    assert len(allocator.prober.checked) == 1
+
+
+def test_clients_changed_while_checked_are_kept(allocator):
+    pid = os.getpid()
+    allocator.get_ports(pid, 1)
+    allocator.set_status(pid, Conn_State.CONNECTED.value)
+
+    clients = allocator._snapshot_clients()
+    stale, alive = allocator.find_stale_clients(clients)
+    assert pid in stale
+    # The client asks for more ports before the result of the check is applied
+    allocator.get_ports(pid, 1)
+    allocator._apply_check(clients, stale, alive)
+    assert allocator.clients[pid]["ports"] == ["5000", "5001"]
+
+
+def test_serve(allocator):
+    allocator.daemon = True
+    allocator.start()
+
+    client = PortAllocatorClient()
+    client.socket.setsockopt(zmq.RCVTIMEO, 5000)
+    client.connect()
+    assert client.get_ports(2) == ["5000", "5001"]
+    client.release_ports(["5000"])
+    client.set_connected()
+    client.socket.close(linger=0)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    """Write leases as if they had been taken before a restart"""
+    def journal(pid, ports, start_time):
+        table = LeaseTable(
+            str(tmp_path / "leases.db"), logging.getLogger(), get_start_time=lambda _: start_time
+        )
+        table.add(pid, ports, Conn_State.CONNECTED.value, 1.0)
+        table.close()
+    return journal
+
+
+def test_recover_live_client(make_allocator, journal):
+    pid = os.getpid()
+    journal(pid, ["5001"], process_start_time(pid))
+
+    allocator = make_allocator()
+    assert allocator.clients[pid]["ports"] == ["5001"]
+    assert allocator.clients[pid]["status"] == Conn_State.CONNECTED.value
+    assert allocator.pool.is_leased(5001)
+    assert allocator.get_ports(DEAD_PID, 2) == ["5000", "5002"]
+
+
+def test_dead_client_ports_cool_down(make_allocator, journal):
+    journal(DEAD_PID, ["5000"], None)
+
+    allocator = make_allocator(reuse_delay=30)
+    assert DEAD_PID not in allocator.clients
+    assert allocator.pool.cooling == 1
+    # The leases of the dead process are forgotten
+    assert allocator.leases.load() == {}
+    assert allocator.get_ports(os.getpid(), 2) == ["5001", "5002"]
+
+
+def test_reused_pid_is_not_recovered(make_allocator, journal):
+    pid = os.getpid()
+    start_time = process_start_time(pid)
+    if start_time is None:
+        pytest.skip("The start time of processes is not known on this platform")
+    # Another process had the same pid when it took the lease
+    journal(pid, ["5000"], start_time - 1)
+
+    allocator = make_allocator()
+    assert pid not in allocator.clients
+    assert not allocator.pool.is_leased(5000)
+
+
+def test_ports_not_computing_anymore_are_dropped(make_allocator, journal):
+    pid = os.getpid()
+    journal(pid, ["5000", "6000"], process_start_time(pid))
+
+    allocator = make_allocator()
+    assert allocator.clients[pid]["ports"] == ["5000"]
+    assert 6000 not in allocator.pool
+
+
+def test_unleased_listening_ports_are_held(make_allocator, tmp_path):
+    # 5001 (0x1389) is listening without a lease
+    proc_net_tcp = tmp_path / "tcp"
+    proc_net_tcp.write_text(
+        "  sl  local_address rem_address   st\n"
+        "   0: 00000000:1389 00000000:0000 0A\n"
+    )
+    prober = FakeProber(files=[str(proc_net_tcp)])
+    allocator = make_allocator(prober=prober)
+    assert allocator.held_ports == {5001}
+
+    # Not given while it's still in use, whatever the reuse delay
+    prober.in_use.add(5001)
+    allocator.check_given_ports_status()
+    assert allocator.pool.available == 2
+    assert allocator.get_ports(os.getpid(), 2) == ["5000", "5002"]
+    allocator.release_ports(os.getpid(), ["5000", "5002"])
+
+    # Released once closed, by the housekeeping run when the ports are needed
+    prober.in_use.clear()
+    assert request(allocator, action=Actions.GET_PORT.value, process=os.getpid(), n=3) == {
+        "ok": ["5000", "5002", "5001"]
+    }
+    assert allocator.held_ports == set()
+
+
+def test_queue_port_is_kept(make_allocator):
+    port = PortAllocator.get_reserved_port()
+    with open(portallocator.opened_port_file, "w") as f:
+        f.write(str(port))
+
+    allocator = make_allocator()
+    assert allocator.queue_port == port
+    with open(portallocator.opened_port_file) as f:
+        assert f.read() == str(port)
@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+from swanportallocator.portpool import PortPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_duplicated_ports_are_ignored():
+    pool = PortPool(["5000", "5001", "5000", 5002])
+    assert len(pool) == 3
+    assert pool.acquire(3) == [5000, 5001, 5002]
+    assert pool.acquire(1) is None
+    pool.check_invariants()
+
+
+def test_acquire_in_order_and_reuse_last():
+    pool = PortPool(range(5000, 5005))
+    assert pool.acquire(2) == [5000, 5001]
+    assert pool.release(5000)
+    assert pool.acquire(3) == [5002, 5003, 5004]
+    assert pool.acquire(1) == [5000]
+    pool.check_invariants()
+
+
+def test_release_twice_or_unknown_port():
+    pool = PortPool(range(5000, 5003))
+    pool.acquire(1)
+    assert pool.release(5000)
+    assert not pool.release(5000)
+    assert not pool.release(6000)
+    assert pool.available == 3
+    pool.check_invariants()
+
+
+def test_reuse_delay():
+    clock = FakeClock()
+    pool = PortPool(range(5000, 5003), reuse_delay=10, clock=clock)
+    assert pool.acquire(1) == [5000]
+    pool.release(5000)
+    assert pool.acquire(1) == [5001]
+    assert pool.cooling == 1
+
+    clock.now = 10
+    pool.release(5001)
+    # 5000 cooled down and goes after 5002, 5001 is still cooling
+    assert pool.acquire(2) == [5002, 5000]
+    # Out of other ports, the cooling one is better than nothing
+    assert pool.acquire(1) == [5001]
+    assert pool.acquire(1) is None
+    pool.check_invariants()
+
+
+def test_take():
+    pool = PortPool(range(5000, 5003))
+    assert pool.take(5001)
+    assert not pool.take(5001)
+    assert not pool.take(6000)
+    assert pool.acquire(2) == [5000, 5002]
+    pool.check_invariants()
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_operations(seed):
+    """Apply random operations, checking them against a simple model of the pool"""
+    rng = random.Random(seed)
+    ports = rng.sample(range(1024, 65536), rng.randint(0, 200))
+    reuse_delay = rng.choice([0, 5, 30])
+    clock = FakeClock()
+    pool = PortPool(ports, reuse_delay=reuse_delay, clock=clock)
+
+    leased = set()
+    released_at = {}
+
+    for _ in range(500):
+        operation = rng.random()
+        clock.now += rng.choice([0, 0, 1, 7])
+
+        if operation < 0.4:
+            n = rng.randint(0, 10)
+            result = pool.acquire(n)
+            if n > len(ports) - len(leased):
+                assert result is None
+                continue
+            assert len(result) == n
+            assert len(set(result)) == n
+            assert leased.isdisjoint(result)
+            assert set(result) <= set(ports)
+            # Ports released recently only if there are no others left
+            cooling = {
+                p for p, t in released_at.items()
+                if p not in leased and clock.now - t < reuse_delay
+            }
+            ready = len(ports) - len(leased) - len(cooling)
+            assert len(cooling.intersection(result)) == max(0, n - ready)
+            leased.update(result)
+
+        elif operation < 0.8:
+            port = rng.choice(ports + [1]) if ports else 1
+            assert pool.release(port) == (port in leased)
+            if port in leased:
+                leased.discard(port)
+                released_at[port] = clock.now
+
+        elif operation < 0.9 and ports:
+            port = rng.choice(ports)
+            assert pool.take(port) == (port not in leased)
+            leased.add(port)
+
+        else:
+            for port in ports:
+                assert pool.is_leased(port) == (port in leased)
+
+        assert pool.leased == len(leased)
+        assert pool.available == len(ports) - len(leased)
+        pool.check_invariants()
@@ -0,0 +1,86 @@
+import contextlib
+import logging
+import socket
+
+import pytest
+
+from swanportallocator.prober import LivenessProber, listening_ports
+
+# Sample of /proc/net/tcp: 8888 and 5000 listening, 5001 connected (state 01)
+PROC_NET_TCP = """\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000:22B8 00000000:0000 0A 00000000:00000000 00:00000000 00000000  1000        0 1001 1 0 100 0 0 10 0
+   1: 0100007F:1388 00000000:0000 0A 00000000:00000000 00:00000000 00000000  1000        0 1002 1 0 100 0 0 10 0
+   2: 0100007F:1389 0100007F:D431 01 00000000:00000000 00:00000000 00000000  1000        0 1003 1 0 20 4 30 10 -1
+"""
+
+# Sample of /proc/net/tcp6: 5002 listening
+PROC_NET_TCP6 = """\
+  sl  local_address                         remote_address                        st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000000000000000000000000000:138A 00000000000000000000000000000000:0000 0A 00000000:00000000 00:00000000 00000000  1000        0 1004 1 0 100 0 0 10 0
+"""
+
+
+@pytest.fixture
+def proc_files(tmp_path):
+    tcp = tmp_path / "tcp"
+    tcp6 = tmp_path / "tcp6"
+    tcp.write_text(PROC_NET_TCP)
+    tcp6.write_text(PROC_NET_TCP6)
+    return [str(tcp), str(tcp6)]
+
+
+@pytest.fixture
+def listening_socket():
+    with contextlib.closing(socket.socket()) as s:
+        s.bind(("127.0.0.1", 0))
+        s.listen(1)
+        yield s.getsockname()[1]
+
+
+@pytest.fixture
+def closed_port():
+    with contextlib.closing(socket.socket()) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_listening_ports(proc_files, tmp_path):
+    assert listening_ports(proc_files) == {8888, 5000, 5002}
+    # Without IPv6
+    assert listening_ports([proc_files[0], str(tmp_path / "missing")]) == {8888, 5000}
+    # Not on Linux
+    assert listening_ports([str(tmp_path / "missing")]) is None
+
+
+def test_clients_listening(proc_files):
+    """The clients with a listening port are found in /proc, without connecting to them"""
+    prober = LivenessProber(logging.getLogger(), host="127.0.0.1", files=proc_files)
+    prober.connectable_ports = lambda ports: pytest.fail("Ports %s were probed" % ports)
+
+    assert prober.clients_in_use({1: ["5000", "6000"], 2: ["5002"]}) == {1, 2}
+
+
+def test_clients_probed(tmp_path, listening_socket, closed_port):
+    """Without /proc, the ports are probed with connections"""
+    prober = LivenessProber(
+        logging.getLogger(), host="127.0.0.1", files=[str(tmp_path / "missing")]
+    )
+    clients = {
+        1: [str(listening_socket)],
+        2: [str(closed_port)],
+        3: [str(closed_port), str(listening_socket)],
+    }
+    assert prober.clients_in_use(clients) == {1, 3}
+
+
+def test_clients_not_listening_are_probed(proc_files, listening_socket, closed_port):
+    """A port not listening in /proc can still accept connections, e.g. from another namespace"""
+    prober = LivenessProber(logging.getLogger(), host="127.0.0.1", files=proc_files)
+    assert prober.clients_in_use({1: [str(listening_socket)], 2: [str(closed_port)]}) == {1}
+
+
+def test_connectable_ports_in_batches(listening_socket, closed_port):
+    prober = LivenessProber(logging.getLogger(), host="127.0.0.1", batch_size=1)
+    ports = [closed_port, listening_socket, closed_port]
+    assert prober.connectable_ports(ports) == {listening_socket}